@@ -23,10 +23,19 @@ case "$1" in
         fi
         ;;
 esac
+# Wheels built with another profile have a local version (e.g.,
+# +throughput) that pip would prefer to the default wheels, so they are left
+# in the wheels directory to be published to a separate index.
+if [ -n "$PROFILE" ]; then
+    export makeindex=false
+fi
 # docker pull "${baseimage}":latest
 ## for testing, build locally via
 # docker build --force-rm --build-arg PYPY=false --build-arg baseimage=quay.io/pypa/manylinux_2_28_x86_64 .
-docker build --force-rm -t girder/large_image_wheels --build-arg PYPY=false --build-arg baseimage=${baseimage} .
+# The time versions.txt was last committed versions the large_image_libs
+# wheel (see shared_libs.py)
+export versions_epoch=`git log -1 --format=%ct -- versions.txt`
+DOCKER_BUILDKIT=1 docker build --force-rm -t girder/large_image_wheels --build-arg PYPY=false --build-arg baseimage=${baseimage} --build-arg PROFILE=${PROFILE} --build-arg WHEEL_COMPRESSION=${WHEEL_COMPRESSION:-zopfli} --build-arg VERSIONS_EPOCH=${versions_epoch} .
 
 mkdir -p wheels
 ls -al wheels
@@ -36,13 +45,7 @@ docker run -v `pwd`/wheels:/opt/mount --rm --entrypoint bash girder/large_image_
 # cp --preserve=timestamps wheels/*.whl wheelhouse/.
 if [ "$makeindex" == "true" ]; then
   python3 copy_changed.py
-  pushd gh-pages
-  echo 'simple503'
-  python3 -m simple503 -B https://github.com/girder/large_image_wheels/raw/wheelhouse ../wheelhouse .
-  mv *.whl* ../wheelhouse/.
-  sed -i 's!https://github.com/girder/large_image_wheels/raw/wheelhouse/!!g' index.html
-  popd
-  python3 make_index.py --append -v
+  python3 make_index.py --simple -v
 fi
 python3 make_index.py wheels -v --no-sha
 ls -al wheels
@@ -0,0 +1,51 @@
+#!/usr/bin/env bash
+# Build the wheels with profile-guided optimization of the tile decoding
+# libraries.  This builds the image three times: normally, instrumented to
+# record profiles, and optimized with the profiles recorded by running
+# pgo.py train in the instrumented image.  The decode throughput of the
+# optimized image is then compared to the normal one, decoding through the
+# installed wheels so that the libraries are the ones the wheels load (the
+# normal image's wheels use their instruction set variants on cpus that
+# support them; PGO builds don't have variants).  Pass an architecture as
+# with build.sh.  The profiles are kept in the pgo directory and the timings
+# in pgo_baseline.json, pgo_optimized.json, and pgo_compare.json.
+
+set -e
+
+case "$1" in
+    x86_64)
+        export baseimage=quay.io/pypa/manylinux_2_28_x86_64:sha256:`getver.py manylinux_2_28_x86_64`
+        ;;
+    aarch64 | arm64)
+        export baseimage=quay.io/pypa/manylinux_2_28_aarch64:sha256:`getver.py manylinux_2_28_aarch64`
+        ;;
+    *)
+        if [ $(arch) == "arm64" ] || [ $(arch) == "aarch64" ]; then
+            export baseimage=quay.io/pypa/manylinux_2_28_aarch64
+        else
+            export baseimage=quay.io/pypa/manylinux_2_28_x86_64
+        fi
+        ;;
+esac
+build() {
+    DOCKER_BUILDKIT=1 docker build --force-rm --build-arg PYPY=false --build-arg baseimage=${baseimage} --build-arg PROFILE=${PROFILE} "$@" .
+}
+train() {
+    docker run --rm -v `pwd`/pgo_fixtures:/tmp/pgo_fixtures -v `pwd`:/opt/mount "$@" --entrypoint bash $image -c "pgo.py train -v --json /opt/mount/$json && chown -R `id -u`:`id -g` /opt/mount/$json /opt/mount/pgo /tmp/pgo_fixtures"
+}
+bench() {
+    docker run --rm -v `pwd`/pgo_fixtures:/tmp/pgo_fixtures -v `pwd`:/opt/mount "$@" --entrypoint bash $image -c "/opt/python/cp312-cp312/bin/python -m venv /tmp/venv && /tmp/venv/bin/pip install -q cffi pillow && /tmp/venv/bin/pip install -q --no-index --find-links /io/wheelhouse GDAL openslide_python pyvips && pgo.py train -v --python /tmp/venv/bin/python --json /opt/mount/$json && chown -R `id -u`:`id -g` /opt/mount/$json /tmp/pgo_fixtures"
+}
+
+mkdir -p pgo_fixtures
+# The profiles have to be removed before any build, since they are copied into
+# the image
+find pgo -mindepth 1 ! -name .gitignore -delete
+build -t girder/large_image_wheels
+build -t girder/large_image_wheels:pgo-generate --build-arg PGO=generate
+image=girder/large_image_wheels:pgo-generate json=pgo_training.json train -v `pwd`/pgo:/build/pgo-generate
+build -t girder/large_image_wheels:pgo --build-arg PGO=use
+
+image=girder/large_image_wheels json=pgo_baseline.json bench
+image=girder/large_image_wheels:pgo json=pgo_optimized.json bench
+python3 pgo.py compare pgo_baseline.json pgo_optimized.json --json pgo_compare.json
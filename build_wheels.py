@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# Build a wheel of the source in the current directory for each python in
+# /opt/py concurrently.  Each build runs in its own copy of the source tree,
+# so builds don't share build directories.
+#   build_wheels.py <label> [--exclude <glob>] [--before <command>] ...
+# The available cpus are split between the concurrent builds; each build
+# gets JOBS, MAKEFLAGS, and CMAKE_BUILD_PARALLEL_LEVEL set to its share.
+# The output of each build is written to /build/logs/<label>-<python>.log,
+# and the start and end of each build are added to /build/log.txt so that
+# duration_summary.py reports them.
+
+import argparse
+import concurrent.futures
+import fnmatch
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+logDir = '/build/logs'
+logFile = '/build/log.txt'
+# Top-level build products that shouldn't be copied to the worktrees
+ignoredTopLevel = {'build', '.eggs', 'dist'}
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def find_pythons(root, includes=None, excludes=None):
+    """
+    List the python installations to build with.
+
+    :param root: the directory with one directory per python.
+    :param includes: if not empty, only use pythons matching one of these
+        glob patterns.
+    :param excludes: skip pythons matching any of these glob patterns.
+    :returns: a sorted list of paths.
+    """
+    names = sorted(os.listdir(root))
+    if includes:
+        names = [name for name in names if any(
+            fnmatch.fnmatch(name, pattern) for pattern in includes)]
+    names = [name for name in names if not any(
+        fnmatch.fnmatch(name, pattern) for pattern in (excludes or []))]
+    return [os.path.join(root, name) for name in names]
+
+
+def job_budget(count, parallel=None, cpus=None):
+    """
+    Decide how many builds to run at once and how many jobs each build may
+    use.
+
+    :param count: the number of builds.
+    :param parallel: the maximum number of concurrent builds.  Defaults to
+        the number of cpus.
+    :param cpus: the number of cpus.  Defaults to the available cpus.
+    :returns: the number of concurrent builds and jobs per build.
+    """
+    cpus = cpus or available_cpus()
+    builds = max(1, min(count, parallel or cpus, cpus))
+    return builds, max(1, cpus // builds)
+
+
+def log_event(label):
+    """
+    Add a line to the build log in the same format as
+    echo "`date` <label>" >> /build/log.txt
+    """
+    if os.path.isdir(os.path.dirname(logFile)):
+        with open(logFile, 'a') as fptr:
+            fptr.write('%s %s\n' % (time.strftime('%a %b %e %H:%M:%S %Z %Y'), label))
+
+
+def copy_tree(src, dest):
+    """
+    Copy a source tree, keeping symlinks and skipping top-level build
+    products.
+    """
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+    shutil.copytree(src, dest, symlinks=True, ignore=lambda path, names: (
+        ignoredTopLevel & set(names) if os.path.samefile(path, src) else set()))
+
+
+def build(python, label, args, jobs):
+    """
+    Build a wheel with one python.
+
+    :param python: the path of the python installation.
+    :param label: a name used for the worktree and logs.
+    :param args: the parsed command line arguments.
+    :param jobs: the number of jobs the build may use.
+    :returns: a dictionary with the python, return code, duration, and log
+        path.
+    """
+    name = os.path.basename(python)
+    worktree = os.path.join(args.tmp, f'{label}-{name}')
+    logPath = os.path.join(args.logs, f'{label}-{name}.log')
+    env = dict(
+        os.environ, JOBS=str(jobs), MAKEFLAGS=f'-j{jobs}',
+        CMAKE_BUILD_PARALLEL_LEVEL=str(jobs), PYBIN=os.path.join(python, 'bin'),
+        PYTHON=os.path.join(python, 'bin', 'python'))
+    log_event(f'{label} {name}')
+    start = time.time()
+    copy_tree(args.source, worktree)
+    commands = list(args.before) + [
+        '"${PYBIN}/pip" wheel . --no-deps -w %s' % args.wheelhouse]
+    with open(logPath, 'w') as log:
+        for command in commands:
+            log.write(f'$ {command}\n')
+            log.flush()
+            returncode = subprocess.call(
+                ['bash', '-c', command], cwd=worktree, env=env, stdout=log,
+                stderr=subprocess.STDOUT)
+            if returncode:
+                break
+    if not args.keep:
+        shutil.rmtree(worktree, ignore_errors=True)
+    log_event(f'{label} {name}')
+    return {
+        'python': name, 'returncode': returncode, 'time': time.time() - start,
+        'log': logPath}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build wheels for several pythons concurrently.')
+    parser.add_argument('label', help='A name for logs and worktrees.')
+    parser.add_argument(
+        '--source', default='.', help='The source directory.')
+    parser.add_argument(
+        '--pythons', default='/opt/py',
+        help='The directory with a directory for each python.')
+    parser.add_argument(
+        '--include', action='append', default=[],
+        help='Only use pythons matching this glob.  Can be repeated.')
+    parser.add_argument(
+        '--exclude', action='append', default=[],
+        help='Skip pythons matching this glob (e.g., "*p39-*").  Can be '
+        'repeated.')
+    parser.add_argument(
+        '--before', action='append', default=[],
+        help='A bash command to run in the worktree before building.  '
+        '${PYBIN} and ${PYTHON} refer to the python being built.  Can be '
+        'repeated.')
+    parser.add_argument(
+        '-w', '--wheelhouse', default='/io/wheelhouse',
+        help='The directory for built wheels.')
+    parser.add_argument(
+        '-P', '--parallel', type=int,
+        help='The maximum number of concurrent builds.  Defaults to the '
+        'number of cpus.  Use fewer for builds that need a lot of memory.')
+    parser.add_argument(
+        '--cpus', type=int, help='The number of cpus to divide between builds.')
+    parser.add_argument(
+        '--tmp', default='/tmp/build_wheels', help='The parent of the worktrees.')
+    parser.add_argument(
+        '--logs', default=logDir, help='The directory for build logs.')
+    parser.add_argument(
+        '--keep', action='store_true', help='Keep the worktrees.')
+    parser.add_argument(
+        '--allow-failures', action='store_true',
+        help='Exit successfully even if some builds fail.')
+    args = parser.parse_args()
+
+    pythons = find_pythons(args.pythons, args.include, args.exclude)
+    builds, jobs = job_budget(len(pythons), args.parallel, args.cpus)
+    print(f'Building {args.label} for {len(pythons)} pythons, {builds} at a '
+          f'time with {jobs} jobs each')
+    os.makedirs(args.tmp, exist_ok=True)
+    os.makedirs(args.logs, exist_ok=True)
+    os.makedirs(args.wheelhouse, exist_ok=True)
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(builds) as pool:
+        results = list(pool.map(lambda python: build(python, args.label, args, jobs), pythons))
+    for result in results:
+        print('%-20s %s %7.1fs %s' % (
+            result['python'], 'failed' if result['returncode'] else 'ok    ',
+            result['time'], result['log']))
+    print('%-20s        %7.1fs (%7.1fs serial)' % (
+        'total', time.time() - start, sum(result['time'] for result in results)))
+    failed = [result for result in results if result['returncode']]
+    for result in failed:
+        print(f'==> Last lines of {result["log"]}')
+        sys.stdout.write(''.join(open(result['log']).readlines()[-40:]))
+    if failed and not args.allow_failures:
+        sys.exit(1)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+# Add the ccache hits and misses since the last call to /build/log.txt.  This
+# is run at the end of each build step:
+#   ccache_stats.py <step>
+# The line has the same date prefix as the step's other log lines, e.g.,
+#   Sat Oct 18 10:12:00 UTC 2026 ccache gdal: 1520 hits, 12 misses (99.2%)
+# The counts come from the stats log (CCACHE_STATSLOG), which ccache appends
+# each compilation's result to.  It is in the image rather than the shared
+# cache mount, so concurrent builds don't mix their counts, and it is removed
+# after it is read.  The cache's own counters are left alone.  This never
+# fails, so it can't break a build step.
+
+import os
+import sys
+import time
+
+logFile = '/build/log.txt'
+
+
+def read_stats(path):
+    """
+    Count the results in a ccache stats log.
+
+    :param path: the path of the stats log.
+    :returns: a dictionary of counter names and values.
+    """
+    stats = {}
+    with open(path) as fptr:
+        for line in fptr:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                stats[line] = stats.get(line, 0) + 1
+    return stats
+
+
+if __name__ == '__main__':
+    step = ' '.join(sys.argv[1:]) or 'build'
+    statsLog = os.environ.get('CCACHE_STATSLOG')
+    try:
+        stats = read_stats(statsLog)
+        os.unlink(statsLog)
+    except Exception:
+        sys.exit(0)
+    hits = stats.get('direct_cache_hit', 0) + stats.get('preprocessed_cache_hit', 0)
+    misses = stats.get('cache_miss', 0)
+    if not hits and not misses:
+        sys.exit(0)
+    with open(logFile, 'a') as fptr:
+        fptr.write('%s ccache %s: %d hits, %d misses (%3.1f%%)\n' % (
+            time.strftime('%a %b %e %H:%M:%S %Z %Y'), step, hits, misses,
+            100.0 * hits / (hits + misses)))
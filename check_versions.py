@@ -1,18 +1,26 @@
 #!/usr/bin/env python3
 
-import functools
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing.pool
+import os
 import re
 import subprocess
 import sys
+import threading
 import time
+import urllib.parse
 
-import packaging.version
 import requests
 import urllib3
 
+from version_key import versionKey
+
 urllib3.disable_warnings()
 
-verbose = len([arg for arg in sys.argv[1:] if arg == '-v'])
+verbose = 0
 
 Packages = {
     'advancecomp': {
@@ -39,6 +47,10 @@ Packages = {
         'git': 'https://gitlab.freedesktop.org/cairo/cairo.git',
         're': r'([0-9]+\.[0-9]+(|\.[0-9]+))$',
     },
+    'ccache': {
+        'git': 'https://github.com/ccache/ccache.git',
+        're': r'v([0-9]+\.[0-9]+(|\.[0-9]+))$',
+    },
     'cmake': {
         'git': 'https://github.com/Kitware/CMake.git',
         're': r'v([0-9]+\.[0-9]+(|\.[0-9]+))$',
@@ -570,104 +582,541 @@ Packages = {
 }
 
 
-def compareVersions(a, b):  # noqa
-    try:
-        av = packaging.version.parse(a)
-    except Exception:
-        try:
-            av = packaging.version.parse(a.replace('_', '.').replace('-', '.'))
-        except Exception:
-            av = a
-    try:
-        bv = packaging.version.parse(b)
-    except Exception:
-        try:
-            bv = packaging.version.parse(b.replace('_', '.').replace('-', '.'))
-        except Exception:
-            bv = b
-    if isinstance(av, str) and not isinstance(bv, str):
-        return -1
-    if not isinstance(av, str) and isinstance(bv, str):
-        return 1
-    try:
-        if av.is_prerelease != bv.is_prerelease:
-            return -1 if av.is_prerelease else 1
-    except Exception:
-        pass
-    if av < bv:
-        return -1
-    if av > bv:
-        return 1
-    return 0
+# Requests sessions are not guaranteed to be thread safe, so each worker
+# thread gets its own.
+sessionLocal = threading.local()
+
+# Limit how many requests are made concurrently to any single host
+hostJobs = 4
+hostLimits = {}
+hostLimitsLock = threading.Lock()
 
 
-session = None
+def hostLimit(url):
+    """
+    Get a semaphore that limits the number of concurrent requests to the host
+    of a url.
+    """
+    host = urllib.parse.urlparse(url).hostname or url
+    with hostLimitsLock:
+        if host not in hostLimits:
+            hostLimits[host] = threading.BoundedSemaphore(hostJobs)
+        return hostLimits[host]
 
 
 def getSession(new=False):
-    global session
-
-    if new or not session:
+    if new or not getattr(sessionLocal, 'session', None):
         session = requests.Session()
         retries = urllib3.util.retry.Retry(
             total=10, backoff_factor=0.1, status_forcelist=[104, 500, 502, 503, 504])
         session.mount('http://', requests.adapters.HTTPAdapter(max_retries=retries))
         session.mount('https://', requests.adapters.HTTPAdapter(max_retries=retries))
-    return session
+        sessionLocal.session = session
+    return sessionLocal.session
 
 
-def getUrl(url, pkginfo, fallback=None):
+# When cacheDir is set, responses are stored on disk.  Entries younger than
+# cacheTTL seconds are used without contacting the server; older http entries
+# are revalidated with conditional requests.  In offline mode, only the cache
+# is used.
+cacheDir = None
+defaultCacheDir = os.path.join(
+    os.path.expanduser('~'), '.cache', 'large_image_wheels', 'check_versions')
+cacheTTL = 3600
+offline = False
+
+
+class CachedResponse:
     """
-    Use a session to get a url.  If it fails, retry with a new session.  If
-    that fails, retry without a session.
+    A minimal stand-in for a requests.Response built from a cache entry.
     """
-    param = {'verify': False} if pkginfo.get('insecure') else {}
+
+    def __init__(self, content, encoding=None, url=None):
+        self.content = content
+        self.encoding = encoding
+        self.url = url
+        self.status_code = 200
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} for url: {self.url}', response=self)
+
+
+def cachePath(key):
+    """
+    Get the path within the cache directory used for a key.  The metadata is
+    stored in this path plus '.json' and the data in this path plus '.data'.
+    """
+    return os.path.join(cacheDir, hashlib.sha256(key.encode()).hexdigest())
+
+
+def cacheRead(key):
+    """
+    Read an entry from the cache.
+
+    :param key: the cache key, such as a url.
+    :returns: the metadata dictionary with the data added as 'content', or
+        None if the key is not cached.
+    """
+    if not cacheDir:
+        return None
+    path = cachePath(key)
     try:
-        return getSession().get(url, **param)
+        entry = json.load(open(path + '.json'))
+        with open(path + '.data', 'rb') as fptr:
+            entry['content'] = fptr.read()
     except Exception:
-        pass
-    try:
+        return None
+    if entry.get('key') != key:
+        return None
+    return entry
+
+
+def cacheWrite(key, content=None, **kwargs):
+    """
+    Add or refresh an entry in the cache.
+
+    :param key: the cache key, such as a url.
+    :param content: the data to store as bytes.  If None, only the metadata
+        is rewritten, which updates its timestamp.
+    :param kwargs: additional metadata, such as etag and last_modified.
+    """
+    if not cacheDir or offline:
+        return
+    path = cachePath(key)
+    entry = dict(kwargs, key=key, time=time.time())
+    # Write to a per-thread file and rename it so concurrent readers never
+    # see a partial entry
+    suffix = '.%d.%d' % (os.getpid(), threading.get_ident())
+    if content is not None:
+        with open(path + '.data' + suffix, 'wb') as fptr:
+            fptr.write(content)
+        os.replace(path + '.data' + suffix, path + '.data')
+    with open(path + '.json' + suffix, 'w') as fptr:
+        json.dump(entry, fptr)
+    os.replace(path + '.json' + suffix, path + '.json')
+
+
+def cacheFresh(entry):
+    """
+    Check if a cache entry can be used without contacting the server.
+    """
+    return entry is not None and (offline or time.time() - entry['time'] < cacheTTL)
+
+
+# Bytes transferred on behalf of the package being checked by the current
+# thread.  Refs shared between packages are counted against the package that
+# fetched them.
+transferStats = threading.local()
+transferStatsLock = threading.Lock()
+
+
+def countBytes(count):
+    """
+    Add to the number of bytes transferred for the current package.
+    """
+    stats = getattr(transferStats, 'current', None)
+    if stats is not None:
+        with transferStatsLock:
+            stats['bytes'] += count
+
+
+def fetchUrl(url, **kwargs):
+    """
+    Use a session to get a url.  If it fails, retry with a new session.  If
+    that fails, retry without a session.
+    """
+    with hostLimit(url):
+        try:
+            return getSession().get(url, **kwargs)
+        except Exception:
+            pass
+        try:
+            if verbose >= 2:
+                print(f'retry {url}')
+            return getSession(True).get(url, **kwargs)
+        except Exception:
+            pass
         if verbose >= 2:
-            print(f'retry {url}')
-        return getSession(True).get(url, **param)
-    except Exception:
-        pass
+            print(f'retry without session {url}')
+        return requests.get(url, **kwargs)
+
+
+# The number of candidates that probe() will request concurrently
+probeWindow = 4
+
+
+def probe(candidates, func, window=None, fallthrough=False):
+    """
+    Evaluate a function on a list of candidates concurrently and return the
+    first success in candidate order.  At most window candidates are in
+    flight at once.  When the most preferred outstanding candidate succeeds,
+    the remaining requests are cancelled.
+
+    :param candidates: an ordered list of values, most preferred first.
+    :param func: a function that is passed a candidate.  It succeeds if it
+        returns a value other than None without raising an exception.
+    :param window: the maximum number of concurrent evaluations.  Defaults
+        to probeWindow.
+    :param fallthrough: if False, an exception from a candidate is raised
+        without trying less preferred candidates, so a transient error can't
+        make an older candidate look current.  If True, less preferred
+        candidates are tried after an exception.
+    :returns: a tuple of the successful candidate and the function's result,
+        or (None, None) if no candidate succeeded.  If no candidate succeeded
+        and any raised an exception, the exception from the most preferred
+        failing candidate is raised instead.
+    """
+    window = max(1, window or probeWindow)
+    firstError = None
+    stats = getattr(transferStats, 'current', None)
+
+    def run(candidate):
+        transferStats.current = stats
+        return func(candidate)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=window)
     try:
+        futures = [executor.submit(run, candidate) for candidate in candidates[:window]]
+        for idx, candidate in enumerate(candidates):
+            if idx + window < len(candidates):
+                futures.append(executor.submit(run, candidates[idx + window]))
+            try:
+                result = futures[idx].result()
+            except Exception as exc:
+                if not fallthrough:
+                    raise
+                firstError = firstError or exc
+                continue
+            if result is not None:
+                return candidate, result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if firstError is not None:
+        raise firstError
+    return None, None
+
+
+def getUrl(url, pkginfo, fallback=None):
+    """
+    Get a url, using the cache if possible.  If the cached response is stale
+    but has an ETag or Last-Modified value, a conditional request is made.  If
+    there is a fallback url, it is requested at the same time and used if the
+    main url can't be fetched.
+    """
+    if fallback:
+        def fetch(url):
+            req = getUrl(url, pkginfo)
+            req.raise_for_status()
+            return req
+
+        url, req = probe([url, fallback], fetch, fallthrough=True)
+        if verbose >= 2 and url == fallback:
+            print(f'used fallback {url}')
+        return req
+    param = {'verify': False} if pkginfo.get('insecure') else {}
+    entry = cacheRead(url)
+    if cacheFresh(entry):
+        return CachedResponse(entry['content'], entry.get('encoding'), url)
+    if offline:
+        raise Exception(f'{url} is not in the cache')
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    req = fetchUrl(url, headers=headers, **param)
+    countBytes(len(req.content))
+    if req.status_code == 304 and entry:
         if verbose >= 2:
-            print(f'retry without session {url}')
-        return requests.get(url, **param)
-    except Exception:
-        if fallback:
-            if verbose >= 2:
-                print(f'retry fallback {url}')
-            return getUrl(fallback, pkginfo)
-        else:
-            raise
+            print(f'not modified {url}')
+        cacheWrite(url, **{k: entry.get(k) for k in ('etag', 'last_modified', 'encoding')})
+        return CachedResponse(entry['content'], entry.get('encoding'), url)
+    if req.status_code == 200:
+        cacheWrite(
+            url, req.content, etag=req.headers.get('ETag'),
+            last_modified=req.headers.get('Last-Modified'), encoding=req.encoding)
+    return req
 
 
-# This can be imported into Chrome
-if len(sys.argv) >= 2 and sys.argv[1] == 'bookmarks':
-    print("""<!DOCTYPE NETSCAPE-Bookmark-file-1>
-  <META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
-  <TITLE>Bookmarks</TITLE>
-  <H1>Bookmarks</H1>
-  <DL><p>
-    <DT><H3>LIW Sources</H3>
-    <DL><p>""")
-    for key, value in Packages.items():
-        url = ([v for v in value.values() if isinstance(v, str) and 'http' in v] + [''])[0]
-        if url:
-            print('      <DT><A HREF="%s">%s</A>' % (url, key))
-    print("""      </DL><p>
-      </DL><p>""")
-    sys.exit(0)
+def hrefs(data):
+    """
+    Get the targets of all links in an html page.
+    """
+    data = data.replace('<A ', '<a ').replace('HREF="', 'href="')
+    return [entry.split('href="', 1)[-1].split('"')[0] for entry in data.split('<a ')[1:]]
+
+
+def gitLsRemote(url, args):
+    """
+    Run git ls-remote against a url, retrying on failure.  Results are
+    cached, but there is no way to revalidate them, so they are used until
+    they expire.
+
+    :param url: the git repository url.  This is used to limit concurrent
+        requests to the same host.
+    :param args: a list of arguments to pass to ls-remote.
+    :returns: the decoded output.
+    """
+    cmd = ['timeout', '15', 'git', 'ls-remote'] + args
+    key = ' '.join(['git', 'ls-remote'] + args)
+    entry = cacheRead(key)
+    if cacheFresh(entry):
+        return entry['content'].decode('utf8')
+    if offline:
+        raise Exception(f'{key} is not in the cache')
+    for retries in range(10, -1, -1):
+        try:
+            with hostLimit(url):
+                output = subprocess.check_output(cmd)
+            break
+        except Exception:
+            if retries:
+                time.sleep(1)
+            else:
+                raise
+    countBytes(len(output))
+    cacheWrite(key, output)
+    return output.decode('utf8')
+
+
+def pktLine(data=None):
+    """
+    Encode a git pkt-line.  If data is None, this is a flush packet.
+    """
+    if data is None:
+        return b'0000'
+    data = data.encode() if isinstance(data, str) else data
+    return b'%04x' % (len(data) + 4) + data
+
 
-failures = False
-for pkg in sorted(Packages):  # noqa
-    if any(val for val in sys.argv[1:] if not val.startswith('-')):
-        check = any(val in pkg for val in sys.argv[1:] if not val.startswith('-'))
-        if not check:
+def pktLines(data):
+    """
+    Decode a sequence of git pkt-lines.
+
+    :param data: the bytes to decode.
+    :returns: a list of decoded lines.  Flush, delimiter, and response-end
+        packets are returned as None.
+    """
+    lines = []
+    pos = 0
+    while pos + 4 <= len(data):
+        length = int(data[pos:pos + 4], 16)
+        if length < 4:
+            lines.append(None)
+            pos += 4
             continue
+        lines.append(data[pos + 4:pos + length].decode('utf8').rstrip('\n'))
+        pos += length
+    return lines
+
+
+def gitSmartLsRefs(url, prefixes):
+    """
+    List refs of an http(s) git remote using git protocol v2's ls-refs
+    command.  Only refs starting with one of the prefixes are sent by the
+    server.
+
+    :param url: the git repository url.
+    :param prefixes: a list of ref prefixes, such as 'HEAD' or 'refs/tags/v'.
+    :returns: 'sha<tab>ref' lines in the same format as git ls-remote.
+    """
+    url = url.rstrip('/')
+    headers = {'Git-Protocol': 'version=2'}
+    with hostLimit(url):
+        req = getSession().get(
+            url + '/info/refs', params={'service': 'git-upload-pack'}, headers=headers)
+        req.raise_for_status()
+        countBytes(len(req.content))
+        if 'version 2' not in pktLines(req.content):
+            raise Exception(f'{url} does not support git protocol v2')
+        body = b''.join(
+            [pktLine('command=ls-refs\n'), b'0001'] +
+            [pktLine(f'ref-prefix {prefix}\n') for prefix in prefixes] +
+            [pktLine()])
+        req = getSession().post(url + '/git-upload-pack', data=body, headers=dict(
+            headers, **{
+                'Content-Type': 'application/x-git-upload-pack-request',
+                'Accept': 'application/x-git-upload-pack-result'}))
+        req.raise_for_status()
+        countBytes(len(req.content))
+    lines = []
+    for line in pktLines(req.content):
+        if line is None:
+            break
+        if line.startswith('ERR '):
+            raise Exception(f'{url}: {line[4:]}')
+        lines.append('\t'.join(line.split(' ')[:2]))
+    return ''.join(line + '\n' for line in lines)
+
+
+def gitLsRefs(url, prefixes):
+    """
+    List the refs of a git remote that start with any of a list of prefixes.
+    For http(s) remotes, git protocol v2 is used in process so only matching
+    refs are transferred.  Otherwise, or if that fails, use git ls-remote.
+
+    :param url: the git repository url.
+    :param prefixes: a list of ref prefixes, such as 'HEAD' or 'refs/tags/v'.
+    :returns: 'sha<tab>ref' lines in the same format as git ls-remote.
+    """
+    if url.startswith(('http://', 'https://')):
+        key = ' '.join(['ls-refs', url] + prefixes)
+        entry = cacheRead(key)
+        if cacheFresh(entry):
+            return entry['content'].decode('utf8')
+        if not offline:
+            try:
+                output = gitSmartLsRefs(url, prefixes)
+                cacheWrite(key, output.encode())
+                return output
+            except Exception as exc:
+                if verbose >= 2:
+                    print(f'ls-refs failed, using ls-remote {url}: {exc}')
+    return gitLsRemote(url, [url] + [
+        prefix if prefix == 'HEAD' else prefix + '*' for prefix in prefixes])
+
+
+def gitTagPrefix(pkginfo):
+    """
+    Determine the literal start of the tag names that a package's 're' can
+    match so that only those tags need to be listed.  The 're' is searched
+    for anywhere in the tag, so a prefix is only derived if it is anchored
+    with '^'.  A 'refprefix' value in the package information overrides this.
+
+    :param pkginfo: the package information.
+    :returns: a prefix that might be the empty string.
+    """
+    if 'refprefix' in pkginfo:
+        return pkginfo['refprefix']
+    pattern = pkginfo.get('re', '')
+    if not pattern.startswith('^'):
+        return ''
+    pattern = pattern[1:]
+    depth = 0
+    for pos, char in enumerate(pattern):
+        if char == '(' and pattern[pos - 1:pos] != '\\':
+            depth += 1
+        elif char == ')' and pattern[pos - 1:pos] != '\\':
+            depth -= 1
+        elif char == '|' and not depth and pattern[pos - 1:pos] != '\\':
+            return ''
+    prefix = ''
+    pos = 0
+    while pos < len(pattern):
+        if pattern[pos] == '\\' and pos + 1 < len(pattern) and not pattern[pos + 1].isalnum():
+            literal, step = pattern[pos + 1], 2
+        elif pattern[pos] not in '.^$*+?{}[]()|\\':
+            literal, step = pattern[pos], 1
+        else:
+            break
+        if pattern[pos + step:pos + step + 1] in {'*', '?', '{'}:
+            break
+        prefix += literal
+        pos += step
+    if '/' in prefix:
+        return ''
+    return prefix
+
+
+# Several Packages entries can refer to the same git remote (e.g., both the
+# most recent tag and the sha of HEAD).  The refs of each remote are fetched
+# once and shared.
+gitRemotes = {}
+gitRemotesLock = threading.Lock()
+
+
+def gitRemoteRefs(url):
+    """
+    Get the refs of a git remote.  Tags are listed if any package uses the
+    remote via 'git' and heads are listed if any package uses it via
+    'gitsha'; both come from a single request.  Only tags that start with the
+    literal prefix of a package's 're' are listed.
+
+    :param url: the git repository url.
+    :returns: a dictionary with 'refs', a dictionary of ref names to shas,
+        and 'tags', a list of 'sha<tab>ref' lines for each tag without peeled
+        entries.
+    """
+    with gitRemotesLock:
+        record = gitRemotes.setdefault(url, {'lock': threading.Lock()})
+    with record['lock']:
+        if 'refs' in record:
+            return record
+        users = [info for info in Packages.values()
+                 if url in {info.get('git'), info.get('gitsha')}]
+        prefixes = set()
+        for info in users:
+            if 'gitsha' in info:
+                branch = info.get('branch', 'HEAD')
+                prefixes |= {branch} if branch == 'HEAD' else {
+                    'refs/heads/' + branch, 'refs/tags/' + branch}
+            if 'git' in info:
+                prefixes.add('refs/tags/' + gitTagPrefix(info))
+        refs = {}
+        tags = []
+        for line in gitLsRefs(url, sorted(prefixes)).split('\n'):
+            if '\t' not in line:
+                continue
+            sha, ref = line.strip().split('\t', 1)
+            refs.setdefault(ref, sha)
+            if ref.startswith('refs/tags/') and not ref.endswith('^{}'):
+                tags.append(line.strip())
+        record['refs'] = refs
+        record['tags'] = tags
+    return record
+
+
+def gitRemoteSha(url, branch='HEAD'):
+    """
+    Get the sha of a branch or other ref of a git remote.
+
+    :param url: the git repository url.
+    :param branch: the name of the ref.
+    :returns: the sha.
+    """
+    refs = gitRemoteRefs(url)['refs']
+    for ref in (branch, 'refs/heads/' + branch):
+        if ref in refs:
+            return refs[ref]
+    return next(sha for ref, sha in refs.items() if ref.endswith('/' + branch))
+
+
+def sourceKind(pkginfo):
+    """
+    Get the kind of source used to check a package, such as 'git' or 'pypi'.
+    """
+    kind = next((key for key in (
+        'filelist', 'fossil', 'git', 'gitsha', 'json', 'pypi', 'text') if key in pkginfo), None)
+    return kind + '+subre' if 'subre' in pkginfo else kind
+
+
+def checkPackage(pkg):  # noqa
+    """
+    Find the most recent version of a package.
+
+    :param pkg: the key of the package in Packages.
+    :returns: a list of output lines, a boolean that is True if an exception
+        occurred, and a dictionary with the package, version, source,
+        latency, bytes, and time of the check.
+    """
+    out = []
+    result = {
+        'package': pkg, 'version': None, 'source': sourceKind(Packages[pkg]),
+        'latency': None, 'bytes': 0, 'time': time.time()}
+    transferStats.current = result
+    start = time.perf_counter()
+
+    def log(*args):
+        out.append(' '.join(str(arg) for arg in args))
+
     try:
         pkginfo = Packages[pkg]
         entries = None
@@ -675,109 +1124,230 @@ for pkg in sorted(Packages):  # noqa
         if 'filelist' in pkginfo:
             data = getUrl(pkginfo['filelist'], pkginfo, pkginfo.get('altfilelist')).text
             if verbose >= 2:
-                print(pkg, 'filelist data', data)
-            data = data.replace('<A ', '<a ').replace('HREF="', 'href="')
-            entries = [
-                entry.split('href="', 1)[-1].split('"')[0] for entry in data.split('<a ')[1:]]
+                log(pkg, 'filelist data', data)
+            entries = hrefs(data)
             if verbose >= 1:
-                print(pkg, 'filelist entries', entries)
+                log(pkg, 'filelist entries', entries)
         elif 'fossil' in pkginfo:
             data = getUrl(pkginfo['fossil'], pkginfo).text
             if verbose >= 2:
-                print(pkg, 'fossil data', data)
+                log(pkg, 'fossil data', data)
             entries = [entry.split(']<')[0]
                        for entry in data.split('<span class="timelineHistDsp">[')[1:]]
             if verbose >= 1:
-                print(pkg, 'fossil entries', entries)
+                log(pkg, 'fossil entries', entries)
         elif 'git' in pkginfo:
-            cmd = ['timeout', '15', 'git', 'ls-remote', '--refs', '--tags', pkginfo['git']]
-            for retries in range(10, -1, -1):
-                try:
-                    entries = [entry for entry in
-                               subprocess.check_output(cmd).decode('utf8').split('\n')
-                               if '/' in entry]
-                    break
-                except Exception:
-                    if retries:
-                        time.sleep(1)
-                    else:
-                        raise
+            entries = gitRemoteRefs(pkginfo['git'])['tags']
             if verbose >= 1:
-                print(pkg, 'git entries', entries)
+                log(pkg, 'git entries', entries)
         elif 'gitsha' in pkginfo:
-            cmd = ['timeout', '15', 'git', 'ls-remote', pkginfo['gitsha'],
-                   pkginfo.get('branch', 'HEAD')]
-            for retries in range(10, -1, -1):
-                try:
-                    versions = [subprocess.check_output(cmd).decode('utf8').split()[0]]
-                    break
-                except Exception:
-                    if retries:
-                        time.sleep(1)
-                    else:
-                        raise
+            versions = [gitRemoteSha(pkginfo['gitsha'], pkginfo.get('branch', 'HEAD'))]
             if verbose >= 1:
-                print(pkg, 'gitsha versions', versions)
+                log(pkg, 'gitsha versions', versions)
         elif 'json' in pkginfo:
             data = getUrl(pkginfo['json'], pkginfo).json()
             if verbose >= 2:
-                print(pkg, 'json data', data)
+                log(pkg, 'json data', data)
             entries = pkginfo['keys'](data)
             if verbose >= 1:
-                print(pkg, 'json entries', entries)
+                log(pkg, 'json entries', entries)
         elif 'pypi' in pkginfo:
             url = 'https://pypi.python.org/pypi/%s/json' % pkginfo['pypi']
             releases = getUrl(url, pkginfo).json()['releases']
             if verbose >= 2:
-                print(pkg, 'pypi releases', releases)
-            versions = sorted(releases, key=functools.cmp_to_key(compareVersions))
+                log(pkg, 'pypi releases', releases)
+            versions = sorted(releases, key=versionKey)
             if verbose >= 1:
-                print(pkg, 'pypi versions', versions)
+                log(pkg, 'pypi versions', versions)
         elif 'text' in pkginfo:
             data = getUrl(pkginfo['text'], pkginfo).content.decode('utf8')
             if verbose >= 2:
-                print(pkg, 'text data', data)
+                log(pkg, 'text data', data)
             entries = pkginfo['keys'](data)
             if verbose >= 1:
-                print(pkg, 'text entries', entries)
+                log(pkg, 'text entries', entries)
         if 're' in pkginfo:
             entries = [entry for entry in entries if re.search(pkginfo['re'], entry)]
             if verbose >= 2:
-                print(pkg, 're entries', entries)
+                log(pkg, 're entries', entries)
             versions = [re.search(pkginfo['re'], entry).group(1) for entry in entries]
             if verbose >= 2:
-                print(pkg, 're versions', versions)
-            versions.sort(key=functools.cmp_to_key(compareVersions))
+                log(pkg, 're versions', versions)
+            versions.sort(key=versionKey)
         if 'subre' in pkginfo:
-            pversions = versions
-            for pos in range(-1, -len(pversions) - 1, -1):
-                data = getUrl(pkginfo['filelist'] + pkginfo['sub'](pversions[pos]), pkginfo).text
+            def subVersions(pversion):
+                data = getUrl(pkginfo['filelist'] + pkginfo['sub'](pversion), pkginfo).text
                 if verbose >= 2:
-                    print(pkg, 'subre data', data)
-                data = data.replace('<A ', '<a ').replace('HREF="', 'href="')
-                entries = [entry.split('href="', 1)[-1].split('"')[0]
-                           for entry in data.split('<a ')[1:]]
+                    log(pkg, 'subre data', pversion, data)
+                entries = hrefs(data)
                 if verbose >= 2:
-                    print(pkg, 'subre entries', entries)
+                    log(pkg, 'subre entries', pversion, entries)
                 entries = [entry for entry in entries if re.search(pkginfo['subre'], entry)]
                 versions = [re.search(pkginfo['subre'], entry).group(1) for entry in entries]
                 if verbose >= 2:
-                    print(pkg, 'subre versions', versions)
-                versions.sort(key=functools.cmp_to_key(compareVersions))
-                if len(versions):
-                    break
+                    log(pkg, 'subre versions', pversion, versions)
+                versions.sort(key=versionKey)
+                return versions if len(versions) else None
+
+            # Probe the newest directories first; the newest one with a
+            # matching file wins.  An error on a newer directory fails the
+            # package rather than reporting an older version.
+            versions = probe(versions[::-1], subVersions)[1] or []
         if versions is None and entries:
             versions = entries
             if verbose >= 2:
-                print(pkg, 'entries versions', versions)
+                log(pkg, 'entries versions', versions)
         if versions is None or not len(versions):
-            print('%s -- failed to get versions' % pkg)
+            log('%s -- failed to get versions' % pkg)
         else:
-            print('%s %s' % (pkg, versions[-1]))
-    except Exception:
+            log('%s %s' % (pkg, versions[-1]))
+            result['version'] = versions[-1]
+    except Exception as exc:
         import traceback
 
-        print('Exception getting %s\n%s' % (pkg, traceback.format_exc()))
-        failures = True
-if failures:
-    sys.exit(1)
+        log('Exception getting %s\n%s' % (pkg, traceback.format_exc()))
+        result['error'] = repr(exc)
+    finally:
+        transferStats.current = None
+        result['latency'] = time.perf_counter() - start
+    return out, 'error' in result, result
+
+
+def readVersions(path):
+    """
+    Read a versions file.
+
+    :param path: the path of the file.
+    :returns: a dictionary of package names to versions.  This is empty if
+        the file doesn't exist.
+    """
+    if not os.path.exists(path):
+        return {}
+    return {
+        line.split(' ', 1)[0]: line.split(' ', 1)[1].strip()
+        for line in open(path).readlines() if ' ' in line.strip()}
+
+
+def printBookmarks():
+    """
+    Print a bookmarks file of the source of each package.  This can be
+    imported into Chrome.
+    """
+    print("""<!DOCTYPE NETSCAPE-Bookmark-file-1>
+  <META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+  <TITLE>Bookmarks</TITLE>
+  <H1>Bookmarks</H1>
+  <DL><p>
+    <DT><H3>LIW Sources</H3>
+    <DL><p>""")
+    for key, value in Packages.items():
+        url = ([v for v in value.values() if isinstance(v, str) and 'http' in v] + [''])[0]
+        if url:
+            print('      <DT><A HREF="%s">%s</A>' % (url, key))
+    print("""      </DL><p>
+      </DL><p>""")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report the most recent version of each package.')
+    parser.add_argument(
+        'packages', nargs='*',
+        help='Only check packages whose names contain one of these '
+        'substrings.  Use "bookmarks" to list package sources instead.')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=8,
+        help='Number of packages to check concurrently.')
+    parser.add_argument(
+        '--host-jobs', type=int, default=hostJobs,
+        help='Maximum number of concurrent requests to any one host.')
+    parser.add_argument(
+        '--probe-window', type=int, default=probeWindow,
+        help='Number of sub-directory or fallback urls of a package to '
+        'request concurrently.')
+    parser.add_argument(
+        '--cache', default=defaultCacheDir,
+        help='A directory used to cache responses between runs.')
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='Do not read or write the cache.')
+    parser.add_argument(
+        '--ttl', type=float, default=cacheTTL,
+        help='Number of seconds a cached response is used before it is '
+        'revalidated.  Use 0 to always revalidate.')
+    parser.add_argument(
+        '--offline', action='store_true',
+        help='Only use cached responses, regardless of their age.')
+    parser.add_argument(
+        '--stale', type=float,
+        help='Only check packages whose last result is older than this many '
+        'seconds; more recent results are reported from the cache.  This '
+        'requires the cache.')
+    parser.add_argument(
+        '--versions', default='versions.txt',
+        help='The versions file to compare against in the json report.  '
+        'Because this is read at start, redirecting the output to the same '
+        'file will empty it before it is read.')
+    parser.add_argument(
+        '--json',
+        help='Write a json report listing each package with its old and new '
+        'versions, source kind, fetch latency, and bytes transferred.')
+    parser.add_argument(
+        '--verbose', '-v', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+    verbose = args.verbose
+    hostJobs = max(1, args.host_jobs)
+    probeWindow = max(1, args.probe_window)
+    if (args.offline or args.stale is not None) and args.no_cache:
+        parser.error('--offline and --stale require the cache')
+    if not args.no_cache:
+        cacheDir = args.cache
+        os.makedirs(cacheDir, exist_ok=True)
+    cacheTTL = args.ttl
+    offline = args.offline
+
+    if args.packages[:1] == ['bookmarks']:
+        printBookmarks()
+        sys.exit(0)
+
+    oldVersions = readVersions(args.versions)
+    resultsPath = os.path.join(cacheDir, 'results.json') if cacheDir else None
+    try:
+        lastResults = json.load(open(resultsPath))
+    except Exception:
+        lastResults = {}
+
+    def checkOrReuse(pkg):
+        last = lastResults.get(pkg)
+        if (args.stale is not None and last and last.get('version') and
+                time.time() - last['time'] < args.stale):
+            return ['%s %s' % (pkg, last['version'])], False, dict(last, checked=False)
+        out, failed, result = checkPackage(pkg)
+        return out, failed, dict(result, checked=True)
+
+    pkgs = [pkg for pkg in sorted(Packages)
+            if not args.packages or any(val in pkg for val in args.packages)]
+    failures = False
+    report = []
+    # imap returns results in the order submitted, so output stays sorted
+    # even though the packages are checked concurrently.
+    with multiprocessing.pool.ThreadPool(processes=max(1, args.jobs)) as pool:
+        for out, failed, result in pool.imap(checkOrReuse, pkgs):
+            for line in out:
+                print(line)
+            sys.stdout.flush()
+            failures = failures or failed
+            if result['checked']:
+                lastResults[result['package']] = {
+                    k: v for k, v in result.items() if k != 'checked'}
+            result['old'] = oldVersions.get(result['package'])
+            result['new'] = result.pop('version')
+            result['changed'] = result['new'] is not None and result['new'] != result['old']
+            report.append(result)
+    if resultsPath and not offline:
+        json.dump(lastResults, open(resultsPath + '.tmp', 'w'), indent=1, sort_keys=True)
+        os.replace(resultsPath + '.tmp', resultsPath)
+    if args.json:
+        json.dump(report, open(args.json, 'w'), indent=2)
+    if failures:
+        sys.exit(1)
@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
+import argparse
+import fcntl
+import json
+import multiprocessing
 import os
 import shutil
 import subprocess
 import sys
 import zipfile
 
+import wheel_store
+
 # Copy any wheels in the ./wheels directory to the ./wheelhouse directory IF
 # - the file doesn't exist in the destintation
 # For GDAL only IF
@@ -13,43 +19,199 @@ import zipfile
 # - any of the CRC checksums of the internal file entries differ EXCEPT for
 #   the records for RECORD and WHEEL.  These can change when only the version
 #   of setuptools changes, which isn't a significant change.
-for name in sorted(os.listdir('wheels')):  # noqa
-    if not name.endswith('.whl'):
-        continue
-    committed = set(subprocess.check_output(
-        ['git', '-C', 'wheelhouse', 'ls-tree', '-r', 'HEAD', '--name-only']
+
+# Only wheels of the current version of these packages are copied.
+versionedPackages = {'GDAL': 'gdal', 'mapnik': 'mapnik-release'}
+ignoredMembers = {'WHEEL', 'RECORD'}
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+def read_versions(path):
+    """
+    Read a versions file.
+
+    :param path: the path of the file.
+    :returns: a dictionary of package names and versions.
+    """
+    return {
+        line.split()[0]: line.split()[1]
+        for line in open(path).readlines() if len(line.split()) >= 2}
+
+
+def committed_files(path):
+    """
+    Get the set of files committed at HEAD in a git repo.
+    """
+    return set(subprocess.check_output(
+        ['git', '-C', path, 'ls-tree', '-r', 'HEAD', '--name-only']
     ).decode().strip().split('\n'))
-    if 'GDAL' in name:
-        current_ver = [line.strip().split()[1] for line in open(
-            'versions.txt').readlines() if line.startswith('gdal ')][0]
-        if f'-{current_ver}.' not in name:
-            continue
-    if 'mapnik' in name:
-        current_ver = [line.strip().split()[1] for line in open(
-            'versions.txt').readlines() if line.startswith('mapnik-release')][0]
-        if f'-{current_ver}.' not in name:
-            continue
-    if name in os.listdir('wheelhouse'):
-        if name in committed:
+
+
+def manifest(path):
+    """
+    Get the members of a wheel and their CRCs.  Only the central directory is
+    read.  The CRCs of WHEEL and RECORD files are ignored, since these can
+    change when only the version of setuptools changes, which isn't a
+    significant change.
+
+    :param path: the path of the wheel.
+    :returns: a dictionary of member names and CRCs.  Ignored CRCs are None.
+    """
+    with zipfile.ZipFile(path) as zptr:
+        return {
+            entry.filename: None if entry.filename.rsplit('/')[-1] in ignoredMembers
+            else entry.CRC for entry in zptr.infolist()}
+
+
+def manifest_difference(new, old):
+    """
+    Describe how two wheel manifests differ.
+
+    :param new: the manifest of the new wheel.
+    :param old: the manifest of the existing wheel.
+    :returns: None if the manifests are equivalent, otherwise a tuple of a
+        reason and the first member that differs or None.
+    """
+    if len(new) != len(old):
+        return 'file count', None
+    for member, crc in new.items():
+        if member not in old:
+            return 'new file', member
+        if crc != old[member]:
+            return 'differ', member
+    return None
+
+
+def compare(src, dest, jobs=None):
+    """
+    Decide which wheels should be copied.
+
+    :param src: the directory with new wheels.
+    :param dest: the wheelhouse directory.  This must be a git repo.
+    :param jobs: the number of processes used to read wheels.
+    :returns: a list of dictionaries, one per wheel in src, with name,
+        copy (a boolean), reason, and, if applicable, the member that
+        differs.
+    """
+    versions = read_versions('versions.txt')
+    committed = committed_files(dest)
+    existing = set(os.listdir(dest))
+    report = []
+    for name in sorted(os.listdir(src)):
+        if not name.endswith('.whl'):
             continue
-        z1 = zipfile.ZipFile(os.path.join('wheels', name))
-        z2 = zipfile.ZipFile(os.path.join('wheelhouse', name))
-        if len(z1.infolist()) == len(z2.infolist()):
-            for entry in z1.infolist():
-                try:
-                    if entry.CRC != z2.getinfo(entry.filename).CRC:
-                        if entry.filename.rsplit('/')[-1] not in {'WHEEL', 'RECORD'}:
-                            print('differ', entry.filename)
-                            break
-                except Exception:
-                    print('new file', entry.filename)
-                    break
+        result = {'name': name, 'copy': True, 'reason': 'new wheel'}
+        for prefix, pkg in versionedPackages.items():
+            if prefix in name and f'-{versions[pkg]}.' not in name:
+                result.update({'copy': False, 'reason': 'old version'})
+        if result['copy'] and name in existing:
+            if name in committed:
+                result.update({'copy': False, 'reason': 'committed'})
+            else:
+                result['reason'] = None
+        report.append(result)
+    compared = [result for result in report if result['copy'] and not result['reason']]
+    paths = [os.path.join(path, result['name']) for result in compared for path in (src, dest)]
+    if paths:
+        with multiprocessing.Pool(jobs) as pool:
+            manifests = pool.map(manifest, paths)
+        for idx, result in enumerate(compared):
+            difference = manifest_difference(manifests[idx * 2], manifests[idx * 2 + 1])
+            if difference is None:
+                result.update({'copy': False, 'reason': 'unchanged'})
             else:
-                continue
-        else:
-            print('file count')
-    else:
-        print('new wheel')
-    print('Copy', name)
-    if len(sys.argv) <= 1:
-        shutil.copy2(os.path.join('wheels', name), os.path.join('wheelhouse', name))
+                result['reason'] = difference[0]
+                if difference[1] is not None:
+                    result['member'] = difference[1]
+    return report
+
+
+def copy_file(src, dest, link=False):
+    """
+    Copy a file, preserving its timestamps.  A reflink is used if the
+    filesystem supports it, otherwise a hardlink if allowed, otherwise the
+    data is copied.  The destination is replaced atomically.
+
+    :param src: the source path.
+    :param dest: the destination path.
+    :param link: if True, hardlink when a reflink isn't possible.  The
+        source and destination then share data, so a later write to the
+        source in place (e.g., cp onto it) also changes the destination.
+    :returns: the method used: 'reflink', 'hardlink', or 'copy'.
+    """
+    tempPath = dest + '.tmp'
+    if os.path.exists(tempPath):
+        os.unlink(tempPath)
+    method = None
+    try:
+        with open(src, 'rb') as sptr, open(tempPath, 'wb') as dptr:
+            fcntl.ioctl(dptr.fileno(), FICLONE, sptr.fileno())
+        shutil.copystat(src, tempPath)
+        method = 'reflink'
+    except OSError:
+        os.unlink(tempPath)
+    if not method and link:
+        try:
+            os.link(src, tempPath)
+            method = 'hardlink'
+        except OSError:
+            pass
+    if not method:
+        shutil.copy2(src, tempPath)
+        method = 'copy'
+    os.replace(tempPath, dest)
+    return method
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Copy new or changed wheels to the wheelhouse.')
+    parser.add_argument(
+        '--source', default='wheels', help='The directory with new wheels.')
+    parser.add_argument(
+        '--dest', default='wheelhouse',
+        help='The wheelhouse directory.  This must be a git repo.')
+    parser.add_argument(
+        '-n', '--dry-run', action='store_true',
+        help='Report what would be copied without copying.')
+    parser.add_argument(
+        '--link', action='store_true',
+        help='Hardlink rather than copying data when a reflink is not '
+        'possible.  Only use this if the source wheels are removed rather '
+        'than overwritten before the next build.')
+    parser.add_argument(
+        '--json', help='Write a json change report to this path, or - for '
+        'stdout.')
+    parser.add_argument(
+        '-j', '--jobs', type=int,
+        help='The number of processes used to read wheels.  This defaults to '
+        'the number of cpus.')
+    parser.add_argument(
+        '--store',
+        help='Also add copied wheels to this content-addressed store (see '
+        'wheel_store.py).')
+    # Historically, any argument meant a dry run.
+    parser.add_argument('legacy', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    report = compare(args.source, args.dest, args.jobs)
+    for result in report:
+        if not result['copy']:
+            continue
+        print(' '.join(
+            value for value in (result['reason'], result.get('member')) if value))
+        print('Copy', result['name'])
+        if not args.dry_run and not args.legacy:
+            result['method'] = copy_file(
+                os.path.join(args.source, result['name']),
+                os.path.join(args.dest, result['name']), args.link)
+    copied = [os.path.join(args.dest, result['name']) for result in report if result.get('method')]
+    if args.store and copied:
+        total, written = wheel_store.pack(args.store, copied, args.jobs)
+        print(f'Stored {total} bytes of wheels as {written} bytes of new blobs')
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+    elif args.json:
+        json.dump(report, open(args.json, 'w'), indent=1)
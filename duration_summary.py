@@ -3,6 +3,7 @@
 # Pass the large_image_wheels build log.txt to stdin:
 # docker run --rm girder/large_image_wheels:latest cat log.txt | ./build_duration.py
 
+import re
 import subprocess
 import sys
 
@@ -20,10 +21,17 @@ else:
 
 starts = {}
 totals = {}
+cacheHits = cacheMisses = 0
 for line in record:
     key = line[28:].strip()
     if not len(key):
         continue
+    # Lines from ccache_stats.py aren't start/end pairs
+    match = re.match(r'ccache .*: (\d+) hits, (\d+) misses', key)
+    if match:
+        cacheHits += int(match.group(1))
+        cacheMisses += int(match.group(2))
+        continue
     date = dateutil.parser.parse(line[:28])
     if key not in starts:
         starts[key] = date
@@ -36,3 +44,6 @@ if len(sys.argv) <= 2:
 for _, key in durations:
     print('%4.0f %s' % (totals[key], key))
 print('%4.0f %s' % (sum(totals.values()), 'total'))
+if cacheHits or cacheMisses:
+    print('ccache: %d hits, %d misses (%3.1f%%)' % (
+        cacheHits, cacheMisses, 100.0 * cacheHits / (cacheHits + cacheMisses)))
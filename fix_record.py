@@ -1,24 +1,250 @@
 #!/usr/bin/env python
 
 # Open a wheel .dist-info RECORD file, recompute the hashes, and save it.
-# Run this in the root directory of the unzipped wheel.
+# Run this in the root directory of the unzipped wheel:
+#   fix_record.py
+# or modify a wheel in place without unzipping it:
+#   fix_record.py <wheel> [--add <member path>=<file or directory>] ...
+#     [--exclude <member glob>] ... [--rehash] [-o <output wheel>]
+# Added files replace members with the same name; directories are added
+# recursively, following symlinks.  Members that aren't replaced are copied
+# without being decompressed, and the RECORD is rewritten with the hashes of
+# the added files.  Files are hashed in fixed-size chunks in worker threads,
+# so memory use doesn't depend on the size of the wheel.
 
+import argparse
 import base64
+import concurrent.futures
+import copy
+import csv
+import fnmatch
 import hashlib
+import io
 import os
+import shutil
 import time
+import zipfile
 
-record_path = os.path.join(next(
-    dir for dir in os.listdir('.') if dir.endswith('.dist-info')), 'RECORD')
-newrecord = []
-for line in open(record_path):
-    parts = line.rsplit(',', 2)
-    if len(parts) == 3 and os.path.exists(parts[0]) and parts[1]:
-        hashval = base64.urlsafe_b64encode(hashlib.sha256(open(
-            parts[0], 'rb').read()).digest()).decode('latin1').rstrip('=')
-        filelen = os.path.getsize(parts[0])
-        line = ','.join([parts[0], 'sha256=' + hashval, str(filelen)]) + '\n'
-    newrecord.append(line)
-open(record_path, 'w').write(''.join(newrecord))
-epoch = int(os.environ.get('SOURCE_DATE_EPOCH', time.time()))
-os.utime(record_path, (epoch, epoch))
+chunkSize = 1024 ** 2
+
+
+def record_hash(fptr):
+    """
+    Hash a file in chunks.
+
+    :param fptr: a binary file-like object.
+    :returns: the RECORD hash value (sha256=<urlsafe base64>) and the size.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    while True:
+        data = fptr.read(chunkSize)
+        if not len(data):
+            break
+        sha256.update(data)
+        size += len(data)
+    hashval = base64.urlsafe_b64encode(sha256.digest()).decode('latin1').rstrip('=')
+    return 'sha256=' + hashval, size
+
+
+def hash_file(path):
+    with open(path, 'rb') as fptr:
+        return record_hash(fptr)
+
+
+def hash_member(wheel, name):
+    # Each thread uses its own handle, since a ZipFile can't be read from
+    # several threads at once.
+    with zipfile.ZipFile(wheel) as zptr, zptr.open(name) as fptr:
+        return record_hash(fptr)
+
+
+def read_record(data):
+    return [row for row in csv.reader(io.StringIO(data)) if row]
+
+
+def write_record(rows):
+    out = io.StringIO()
+    csv.writer(out, lineterminator='\n').writerows(rows)
+    return out.getvalue()
+
+
+def fix_directory(jobs=None):
+    """
+    Recompute the hashes of the RECORD of an unzipped wheel in the current
+    directory.
+    """
+    record_path = os.path.join(next(
+        dir for dir in os.listdir('.') if dir.endswith('.dist-info')), 'RECORD')
+    rows = read_record(open(record_path, newline='').read())
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        hashes = {
+            row[0]: pool.submit(hash_file, row[0]) for row in rows
+            if len(row) == 3 and os.path.exists(row[0]) and row[1]}
+        rows = [
+            [row[0], hashes[row[0]].result()[0], str(hashes[row[0]].result()[1])]
+            if row[0] in hashes else row for row in rows]
+    open(record_path, 'w').write(write_record(rows))
+    epoch = int(os.environ.get('SOURCE_DATE_EPOCH', time.time()))
+    os.utime(record_path, (epoch, epoch))
+
+
+def collect_additions(additions):
+    """
+    Expand a list of additions to individual files.
+
+    :param additions: a list of (member path, file or directory) tuples.
+    :returns: a dictionary of member names and file paths.  Later additions
+        take precedence.
+    """
+    files = {}
+    for arcname, path in additions:
+        arcname = arcname.strip('/')
+        if not os.path.isdir(path):
+            files[arcname] = path
+            continue
+        for root, _dirs, names in os.walk(path, followlinks=True):
+            for name in names:
+                filepath = os.path.join(root, name)
+                files[arcname + '/' + os.path.relpath(filepath, path).replace(
+                    os.sep, '/')] = filepath
+    return files
+
+
+def copy_raw(src, zinfo, dest):
+    """
+    Copy a member from one zip file to another without decompressing it.
+
+    :param src: the source ZipFile.
+    :param zinfo: the ZipInfo of the member in the source.
+    :param dest: the destination ZipFile.
+    """
+    info = copy.copy(zinfo)
+    # Sizes and CRC are written in the local header rather than in a data
+    # descriptor.
+    info.flag_bits &= ~0x08
+    src.fp.seek(zinfo.header_offset)
+    header = src.fp.read(30)
+    src.fp.seek(zinfo.header_offset + 30 + int.from_bytes(header[26:28], 'little') +
+                int.from_bytes(header[28:30], 'little'))
+    info.header_offset = dest.fp.tell()
+    dest.fp.write(info.FileHeader())
+    remaining = zinfo.compress_size
+    while remaining:
+        data = src.fp.read(min(chunkSize, remaining))
+        dest.fp.write(data)
+        remaining -= len(data)
+    dest.filelist.append(info)
+    dest.NameToInfo[info.filename] = info
+    dest.start_dir = dest.fp.tell()
+
+
+def add_file(dest, arcname, path, epoch):
+    info = zipfile.ZipInfo.from_file(path, arcname)
+    if epoch is not None and time.mktime(info.date_time + (0, 0, -1)) > epoch:
+        info.date_time = time.localtime(epoch)[:6]
+    info.compress_type = zipfile.ZIP_DEFLATED
+    with open(path, 'rb') as fptr, dest.open(info, 'w') as zfptr:
+        shutil.copyfileobj(fptr, zfptr, chunkSize)
+
+
+def fix_wheel(wheel, additions=None, excludes=None, output=None, rehash=False, jobs=None):
+    """
+    Add, replace, or remove members of a wheel and rewrite its RECORD.
+
+    :param wheel: the path of the wheel.
+    :param additions: a list of (member path, file or directory) tuples.
+    :param excludes: a list of glob patterns of members to remove.
+    :param output: the path of the output wheel.  If None, the wheel is
+        replaced.
+    :param rehash: if True, rehash every member.  Otherwise, members that are
+        copied keep their RECORD hashes unless they have none.
+    :param jobs: the number of threads used for hashing.
+    :returns: a dictionary with the number of copied, added, and removed
+        members.
+    """
+    files = collect_additions(additions or [])
+    excludes = excludes or []
+    files = {arcname: path for arcname, path in files.items()
+             if not any(fnmatch.fnmatchcase(arcname, pattern) for pattern in excludes)}
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    epoch = int(epoch) if epoch else None
+    output = output or wheel
+    tempPath = output + '.tmp'
+    stats = {'copied': 0, 'added': 0, 'removed': 0}
+    with zipfile.ZipFile(wheel) as src, concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        recordName = next(
+            name for name in src.namelist()
+            if name.count('/') == 1 and name.endswith('.dist-info/RECORD'))
+        rows = read_record(src.read(recordName).decode('utf8'))
+        oldHashes = {row[0]: row[1:] for row in rows if len(row) == 3 and row[1]}
+        hashes = {arcname: pool.submit(hash_file, path) for arcname, path in files.items()}
+        with zipfile.ZipFile(tempPath, 'w') as dest:
+            for zinfo in src.infolist():
+                if (zinfo.filename == recordName or zinfo.filename in files or any(
+                        fnmatch.fnmatchcase(zinfo.filename, pattern) for pattern in excludes)):
+                    if zinfo.filename != recordName and zinfo.filename not in files:
+                        stats['removed'] += 1
+                    continue
+                if not zinfo.is_dir() and (rehash or zinfo.filename not in oldHashes):
+                    hashes[zinfo.filename] = pool.submit(hash_member, wheel, zinfo.filename)
+                copy_raw(src, zinfo, dest)
+                stats['copied'] += 1
+            for arcname, path in files.items():
+                add_file(dest, arcname, path, epoch)
+                stats['added'] += 1
+            names = [zinfo.filename for zinfo in dest.infolist() if not zinfo.is_dir()]
+            record = []
+            for name in names:
+                if name in hashes:
+                    hashval, size = hashes[name].result()
+                    record.append([name, hashval, str(size)])
+                else:
+                    record.append([name] + oldHashes[name])
+            record.append([recordName, '', ''])
+            info = copy.copy(src.getinfo(recordName))
+            if epoch is not None:
+                info.date_time = time.localtime(epoch)[:6]
+            dest.writestr(info, write_record(record))
+    os.replace(tempPath, output)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Recompute the hashes in a wheel RECORD.  Without a '
+        'wheel, this works on an unzipped wheel in the current directory.')
+    parser.add_argument('wheel', nargs='?', help='A wheel to modify.')
+    parser.add_argument(
+        '--add', action='append', default=[],
+        help='<member path>=<file or directory>.  Add a file or directory to '
+        'the wheel, replacing existing members.  This can be repeated; later '
+        'additions take precedence.')
+    parser.add_argument(
+        '--exclude', action='append', default=[],
+        help='A glob pattern of members to remove or not add.  This can be '
+        'repeated.')
+    parser.add_argument(
+        '-o', '--output', help='The output wheel.  Defaults to replacing the '
+        'wheel.')
+    parser.add_argument(
+        '--rehash', action='store_true',
+        help='Recompute the hash of every member, not just added members '
+        'and members without a hash.')
+    parser.add_argument(
+        '-j', '--jobs', type=int, help='The number of threads used for hashing.')
+    parser.add_argument(
+        '--verbose', '-v', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+
+    if not args.wheel:
+        fix_directory(args.jobs)
+    else:
+        start = time.time()
+        stats = fix_wheel(
+            args.wheel, [tuple(addition.split('=', 1)) for addition in args.add],
+            args.exclude, args.output, args.rehash, args.jobs)
+        if args.verbose >= 1:
+            print('%s: %d copied, %d added, %d removed in %5.3fs' % (
+                args.wheel, stats['copied'], stats['added'], stats['removed'],
+                time.time() - start))
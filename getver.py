@@ -1,20 +1,63 @@
 #!/usr/bin/env python
 # getver.py <package> [<last component:all> [<seperator:.>
 #   [<output seperator:seperator> [<first component:0>]]]]
+# getver.py --export [<output path:stdout>]
+#   Write a shell-sourceable file that sets VER_<PACKAGE> for every package
+#   plus the commonly used derived forms, so build steps can use variables
+#   rather than running this script for each value.  <PACKAGE> is the
+#   package name in upper case with non-alphanumerics replaced by _.  For
+#   instance, with "curl 8_11_1":
+#     VER_CURL=8_11_1
+#     VER_CURL_MAJOR=8_11_1       (getver.py curl 1)
+#     VER_CURL_MAJOR_MINOR=8_11_1 (getver.py curl 2)
+#     VER_CURL_MINOR=             (getver.py curl 2 . . 1)
+#     VER_CURL_DOTTED=8.11.1      (_ replaced with ., getver.py curl 3 _ .)
+#     VER_CURL_UNDERSCORED=8_11_1 (. replaced with _)
 
 import os
+import re
+import shlex
 import sys
 
+
+def slice_version(ver, last=None, sep='.', sep2=None, first=0):
+    if last is None:
+        return ver
+    return (sep2 if sep2 is not None else sep).join(ver.split(sep)[first:last])
+
+
+def export(versions, out):
+    for pkg, ver in sorted(versions.items()):
+        name = 'VER_' + re.sub('[^A-Z0-9]', '_', pkg.upper())
+        forms = {
+            '': ver,
+            '_MAJOR': slice_version(ver, 1),
+            '_MAJOR_MINOR': slice_version(ver, 2),
+            '_MINOR': slice_version(ver, 2, first=1),
+            '_DOTTED': ver.replace('_', '.'),
+            '_UNDERSCORED': ver.replace('.', '_'),
+        }
+        for suffix, value in forms.items():
+            out.write('export %s%s=%s\n' % (name, suffix, shlex.quote(value)))
+
+
 path = 'versions.txt'
 if not os.path.exists(path):
     path = '/build/versions.txt'
 versions = {
     line.split(' ', 1)[0]: line.split(' ', 1)[1].strip()
     for line in open(path).readlines()}
+if sys.argv[1] == '--export':
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w') as out:
+            export(versions, out)
+    else:
+        export(versions, sys.stdout)
+    sys.exit(0)
 ver = versions[sys.argv[1]]
 if len(sys.argv) > 2:
-    sep = sys.argv[3] if len(sys.argv) > 3 else '.'
-    sep2 = sys.argv[4] if len(sys.argv) > 4 else sep
-    ver = sep2.join(ver.split(sep)[
-        int(sys.argv[5]) if len(sys.argv) > 5 else 0:int(sys.argv[2])])
+    ver = slice_version(
+        ver, int(sys.argv[2]), sys.argv[3] if len(sys.argv) > 3 else '.',
+        sys.argv[4] if len(sys.argv) > 4 else None,
+        int(sys.argv[5]) if len(sys.argv) > 5 else 0)
 sys.stdout.write(ver)
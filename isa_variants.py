@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+# Build and package copies of the performance-critical libraries for a newer
+# instruction set (x86-64-v3 on x86_64, armv8.2-a on aarch64).
+#   isa_variants.py name|cflags|prefix
+# prints the variant for this architecture, the extra compiler flags for it,
+# and the install prefix that the variant builds use.  Nothing is printed if
+# the ISA_VARIANTS environment variable is empty or "none", or if it is "auto"
+# and the PGO environment variable is set, since the variants aren't built with
+# profiles and would be used instead of the profiled libraries on most cpus.
+#   isa_variants.py add <wheel> ... [-v]
+# adds the variant libraries in the prefix to repaired wheels.  A library is
+# added as <package>.libs/<variant>/<name> when the wheel's .libs directory
+# has a library with the same soname; the copy gets the same auditwheel name
+# and soname, and its dependencies are renamed to match the wheel.  The
+# _libs_loader.py module in each package chooses between the copies when it is
+# imported.
+
+import argparse
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+import fix_record
+
+variants = {
+    'x86_64': {'name': 'x86-64-v3', 'cflags': '-march=x86-64-v3'},
+    'aarch64': {'name': 'armv8.2-a', 'cflags': '-march=armv8.2-a'},
+}
+prefixRoot = '/usr/local/isa'
+# auditwheel renames libraries to <name>-<8 hex digits>.<extension>
+auditwheelName = re.compile(r'^(?P<base>.+)-[0-9a-f]{8}(?P<ext>\.so(\..*)?)$')
+
+
+def current_variant(setting=None, machine=None, pgo=None):
+    """
+    Get the variant to build.
+
+    :param setting: 'auto' for the default variant for the architecture, '' or
+        'none' to not build variants, or a variant name.  Defaults to the
+        ISA_VARIANTS environment variable.
+    :param machine: the architecture.  Defaults to the current architecture.
+    :param pgo: the PGO mode.  If set, 'auto' doesn't build variants.
+        Defaults to the PGO environment variable.
+    :returns: a dictionary with the name and cflags of the variant or None.
+    """
+    setting = (os.environ.get('ISA_VARIANTS', 'auto') if setting is None else setting).strip()
+    pgo = (os.environ.get('PGO', '') if pgo is None else pgo).strip()
+    variant = variants.get(machine or os.environ.get('AUDITWHEEL_ARCH') or platform.machine())
+    if setting in ('', 'none') or (setting == 'auto' and pgo) or not variant:
+        return None
+    if setting not in ('auto', variant['name']):
+        raise ValueError(f'Unknown instruction set variant {setting}')
+    return dict(variant, prefix=os.path.join(prefixRoot, variant['name']))
+
+
+def soname(path):
+    return subprocess.check_output(
+        ['patchelf', '--print-soname', path], encoding='utf8').strip()
+
+
+def needed(path):
+    return subprocess.check_output(
+        ['patchelf', '--print-needed', path], encoding='utf8').split()
+
+
+def variant_libraries(prefix):
+    """
+    List the shared libraries in a variant prefix.
+
+    :param prefix: the install prefix of the variant builds.
+    :returns: a dictionary of sonames and paths.
+    """
+    libs = {}
+    for libdir in ('lib', 'lib64'):
+        libdir = os.path.join(prefix, libdir)
+        if not os.path.isdir(libdir):
+            continue
+        for name in sorted(os.listdir(libdir)):
+            path = os.path.join(libdir, name)
+            if '.so' in name and os.path.isfile(path) and not os.path.islink(path):
+                libs[soname(path)] = path
+    return libs
+
+
+def add_variants(wheel, variant, verbose=0):
+    """
+    Add variant libraries to a repaired wheel.
+
+    :param wheel: the path of the wheel.  This is modified in place.
+    :param variant: a dictionary from current_variant.
+    :param verbose: verbosity level.
+    :returns: the list of added member names.
+    """
+    available = variant_libraries(variant['prefix'])
+    added = []
+    with tempfile.TemporaryDirectory(prefix='isa_') as tempdir:
+        with zipfile.ZipFile(wheel) as zptr:
+            bundled = {}
+            for name in zptr.namelist():
+                parts = name.split('/')
+                match = auditwheelName.match(parts[-1])
+                if len(parts) == 2 and parts[0].endswith('.libs') and match:
+                    bundled[match.group('base') + match.group('ext')] = name
+            libsdir = os.path.dirname(next(iter(bundled.values()), ''))
+            adddir = os.path.join(tempdir, variant['name'])
+            os.makedirs(adddir)
+            baseline = os.path.join(tempdir, 'baseline')
+            for original, member in sorted(bundled.items()):
+                if original not in available:
+                    continue
+                arcname = os.path.basename(member)
+                path = os.path.join(adddir, arcname)
+                with zptr.open(member) as src, open(baseline, 'wb') as dest:
+                    shutil.copyfileobj(src, dest)
+                shutil.copy2(available[original], path)
+                os.chmod(path, 0o755)
+                cmd = ['patchelf', '--set-soname', arcname, '--set-rpath', '$ORIGIN:$ORIGIN/..']
+                renamed = []
+                for dep in needed(path):
+                    if dep in bundled:
+                        cmd += ['--replace-needed', dep, os.path.basename(bundled[dep])]
+                    renamed.append(os.path.basename(bundled.get(dep, dep)))
+                # If the variant was built with different dependencies than the
+                # baseline library, the two aren't interchangeable.
+                if set(renamed) != set(needed(baseline)):
+                    print(f'{wheel}: not adding {original}; its dependencies differ '
+                          'from the bundled library', file=sys.stderr)
+                    os.unlink(path)
+                    continue
+                subprocess.check_call(cmd + [path])
+                added.append(f'{libsdir}/{variant["name"]}/{arcname}')
+                if verbose >= 2:
+                    print(f'{wheel}: adding {added[-1]}')
+        if added:
+            fix_record.fix_wheel(wheel, [(f'{libsdir}/{variant["name"]}', adddir)])
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build and package libraries for newer instruction sets.')
+    parser.add_argument(
+        'command', choices=['name', 'cflags', 'prefix', 'add'],
+        help='Print the variant name, compiler flags, or install prefix, or '
+        'add variant libraries to wheels.')
+    parser.add_argument('wheels', nargs='*', help='Wheels to modify in place.')
+    parser.add_argument(
+        '--verbose', '-v', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+
+    try:
+        variant = current_variant()
+    except ValueError as exc:
+        parser.error(str(exc))
+    if args.command != 'add':
+        if variant:
+            print(variant[args.command])
+        sys.exit(0)
+    for wheel in args.wheels if variant else []:
+        added = add_variants(wheel, variant, args.verbose)
+        if args.verbose >= 1:
+            print(f'{wheel}: added {len(added)} {variant["name"]} libraries')
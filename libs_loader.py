@@ -0,0 +1,209 @@
+# This is copied into the python packages that bundle native libraries as
+# <package>/_libs_loader.py.  Wheels can contain copies of the
+# performance-critical libraries built for a newer instruction set in
+# <package>.libs/<variant>/ (see isa_variants.py).  The patched package
+# initializers use this to load the best copy the cpu supports.  Set the
+# LARGE_IMAGE_WHEELS_ISA environment variable to a variant name (e.g.,
+# x86-64-v3) to use that variant regardless of the cpu, or to "baseline" to
+# only use the baseline libraries.  Library paths are found once per
+# directory and only looked up again if the directory changes.  Paths that
+# aren't needed at import (e.g., osgeo.GEOS_LIBRARY_PATH) are only found when
+# they are first used.
+
+import ctypes
+import ctypes.util
+import os
+import platform
+
+envVar = 'LARGE_IMAGE_WHEELS_ISA'
+# Libraries used by several packages can be in a large_image_libs wheel (see
+# shared_libs.py), which installs them next to the <package>.libs directories.
+sharedLibsDir = 'large_image_libs.libs'
+
+# Variants in order of preference and the /proc/cpuinfo features each needs
+variantFeatures = {
+    'x86_64': [
+        ('x86-64-v3', {
+            'avx', 'avx2', 'bmi1', 'bmi2', 'f16c', 'fma', 'abm', 'movbe',
+            'xsave', 'cx16', 'lahf_lm', 'popcnt', 'sse4_1', 'sse4_2', 'ssse3'}),
+    ],
+    'aarch64': [
+        ('armv8.2-a', {'atomics', 'asimdrdm', 'crc32', 'dcpop'}),
+    ],
+}
+
+_selected = {}
+_loaded = {}
+_listings = {}
+
+
+def cpu_features():
+    """
+    Get the cpu features listed in /proc/cpuinfo.
+
+    :returns: a set of feature names.
+    """
+    try:
+        with open('/proc/cpuinfo') as fptr:
+            for line in fptr:
+                key, _, value = line.partition(':')
+                if key.strip() in {'flags', 'Features'}:
+                    return set(value.split())
+    except OSError:
+        pass
+    return set()
+
+
+def select_variant(libsdir):
+    """
+    Choose which variant of the libraries in a directory to use.
+
+    :param libsdir: a <package>.libs directory.
+    :returns: the path of the variant directory or None to use the baseline
+        libraries.
+    """
+    if libsdir not in _selected:
+        choice = os.environ.get(envVar, '').strip() or 'auto'
+        available = {
+            name for name in os.listdir(libsdir)
+            if os.path.isdir(os.path.join(libsdir, name))}
+        selected = None
+        if choice in available:
+            selected = choice
+        elif choice == 'auto':
+            features = cpu_features()
+            for name, required in variantFeatures.get(platform.machine(), []):
+                if name in available and required <= features:
+                    selected = name
+                    break
+        _selected[libsdir] = os.path.join(libsdir, selected) if selected else None
+    return _selected[libsdir]
+
+
+def preload(libsdir):
+    """
+    Load the selected variant of the libraries in a directory.  Each variant
+    has the soname of the baseline library it replaces, so extension modules
+    and other libraries that depend on it use the loaded copy.  If no variant
+    library can be loaded, the baseline libraries are used.  If some are
+    loaded and another fails, they can't be unloaded, so this raises rather
+    than reporting the baseline libraries.
+
+    :param libsdir: a <package>.libs directory.
+    :returns: the path of the variant directory or None if the baseline
+        libraries are used.
+    """
+    variant = select_variant(libsdir)
+    if variant and variant not in _loaded:
+        loaded = []
+        try:
+            # Variants depend on each other through their rpath, so the order
+            # they are loaded in doesn't matter.
+            for name in sorted(os.listdir(variant)):
+                loaded.append(ctypes.CDLL(os.path.join(variant, name)))
+        except OSError as exc:
+            if loaded:
+                raise OSError(
+                    f'Only some of the libraries in {variant} could be loaded; set '
+                    f'{envVar}=baseline to use the baseline libraries') from exc
+            _selected[libsdir] = variant = None
+        else:
+            _loaded[variant] = loaded
+    return variant
+
+
+def libraries(libsdir):
+    """
+    List the libraries in a directory, using the selected variant of each
+    library where there is one.  Libraries that were moved to the shared
+    large_image_libs wheel are listed from its directory.  The list is cached
+    until the modification time of either directory changes.
+
+    :param libsdir: a <package>.libs directory.
+    :returns: a dictionary of library file names and paths.
+    """
+    variant = preload(libsdir)
+    shareddir = os.path.join(os.path.dirname(libsdir), sharedLibsDir)
+    mtime = (os.stat(libsdir).st_mtime_ns,
+             os.stat(shareddir).st_mtime_ns if os.path.isdir(shareddir) else None)
+    cached = _listings.get(libsdir)
+    if cached and cached[0] == mtime and cached[1] == variant:
+        return cached[2]
+    libs = {}
+    if mtime[1] is not None:
+        for name in sorted(os.listdir(shareddir)):
+            libs[name] = os.path.join(shareddir, name)
+    for name in sorted(os.listdir(libsdir)):
+        path = os.path.join(libsdir, name)
+        if os.path.isdir(path):
+            continue
+        if variant and os.path.exists(os.path.join(variant, name)):
+            path = os.path.join(variant, name)
+        libs[name] = path
+    _listings[libsdir] = (mtime, variant, libs)
+    return libs
+
+
+def find_library(libsdir, prefix):
+    """
+    Find a library in a directory, preferring the selected variant.
+
+    :param libsdir: a <package>.libs directory.
+    :param prefix: the start of the library's file name, e.g., 'libvips'.
+    :returns: the path of the library.
+    """
+    for name, path in libraries(libsdir).items():
+        if name.startswith(prefix):
+            return path
+    raise OSError(f'No {prefix} library in {libsdir}')
+
+
+def load_stdcxx():
+    """
+    Load libstdc++ globally.  Loading libraries in different orders can lead
+    to cryptic TLS (thread local storage) errors; loading stdc++ before the
+    others seems to prevent this.
+    """
+    if 'stdc++' not in _loaded:
+        try:
+            _loaded['stdc++'] = ctypes.CDLL(
+                ctypes.util.find_library('stdc++'), mode=ctypes.RTLD_GLOBAL)
+        except Exception:
+            _loaded['stdc++'] = None
+
+
+def load_library(libsdir, prefix, mode=ctypes.DEFAULT_MODE):
+    """
+    Load a library from a directory once, preferring the selected variant.
+
+    :param libsdir: a <package>.libs directory.
+    :param prefix: the start of the library's file name, e.g., 'libgdal-'.
+    :param mode: the mode passed to ctypes.CDLL.
+    :returns: the ctypes.CDLL of the library.
+    """
+    path = find_library(libsdir, prefix)
+    if path not in _loaded:
+        _loaded[path] = ctypes.CDLL(path, mode=mode)
+    return _loaded[path]
+
+
+def lazy_paths(libsdir, prefixes):
+    """
+    Make a module __getattr__ function that finds library paths when they are
+    first used.  For instance,
+        __getattr__ = _libs_loader.lazy_paths(_libsdir, {
+            'GDAL_LIBRARY_PATH': 'libgdal-'})
+    in a package's __init__.py makes <package>.GDAL_LIBRARY_PATH the path of
+    the selected libgdal without listing the directory at import.
+
+    :param libsdir: a <package>.libs directory.
+    :param prefixes: a dictionary of attribute names and the start of the
+        library file name to find for each.
+    :returns: a function for a module's __getattr__.
+    """
+    def __getattr__(name):
+        if name not in prefixes:
+            raise AttributeError(name)
+        return find_library(libsdir, prefixes[name])
+
+    return __getattr__
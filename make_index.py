@@ -1,11 +1,16 @@
 #!/usr/bin/env python
 
 import argparse
+import email.parser
 import hashlib
+import html
+import json
 import multiprocessing
 import os
+import re
 import sys
 import time
+import zipfile
 
 indexName = 'index.html'
 template = """<!DOCTYPE html>
@@ -20,16 +25,36 @@ template = """<!DOCTYPE html>
 """
 link = '<a href="%s%s#sha256=%s" download="%s">%s</a>%s%s%11d'
 linknosha = '<a href="%s%s" download="%s">%s</a>%s%s%11d'
+# Per-project pages of a PEP 503 simple index; a PEP 691 index.json is
+# written next to each index.html.
+simpleTemplate = """<!DOCTYPE html>
+<html>
+<head>
+<meta name="pypi:repository-version" content="1.1">
+<title>%TITLE%</title>
+</head>
+<body>
+<h1>%TITLE%</h1>
+%LINKS%
+</body>
+</html>
+"""
+simpleApiVersion = '1.1'
+
+
+cacheName = '.sha256cache.json'
 
 
 def get_sha256(path, name, verbose):
-    sha256 = hashlib.sha256()
-    if args.verbose >= 2:
-         print(f'Getting sha256 for {name}')
-    elif args.verbose >= 1:
-         sys.stdout.write(f'sha256: {name[:71]}\r')
-         sys.stdout.flush()
+    if verbose >= 2:
+        print(f'Getting sha256 for {name}')
+    elif verbose >= 1:
+        sys.stdout.write(f'sha256: {name[:71]}\r')
+        sys.stdout.flush()
     with open(os.path.join(path, name), 'rb') as fptr:
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(fptr, 'sha256').hexdigest()
+        sha256 = hashlib.sha256()
         while True:
             data = fptr.read(1024 ** 2)
             if not len(data):
@@ -38,6 +63,218 @@ def get_sha256(path, name, verbose):
     return sha256.hexdigest()
 
 
+def file_key(path, name):
+    """
+    Get the values that identify an unchanged file for the digest cache.
+    """
+    stat = os.stat(os.path.join(path, name))
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'inode': stat.st_ino}
+
+
+def load_cache(cachePath):
+    """
+    Load the digest cache.
+
+    :param cachePath: the path of the cache or None.
+    :returns: a dictionary keyed by absolute file path.
+    """
+    if cachePath and os.path.exists(cachePath):
+        return json.load(open(cachePath))
+    return {}
+
+
+def save_cache(cachePath, cache):
+    if cachePath:
+        json.dump(cache, open(cachePath + '.tmp', 'w'), indent=1, sort_keys=True)
+        os.replace(cachePath + '.tmp', cachePath)
+
+
+def cache_entry(cache, path, name):
+    """
+    Get the cache entry for a file if the file hasn't changed since it was
+    cached.
+    """
+    entry = cache.get(os.path.abspath(os.path.join(path, name)))
+    if entry and {k: entry.get(k) for k in ('size', 'mtime_ns', 'inode')} == file_key(
+            path, name):
+        return entry
+    return None
+
+
+def update_cache(cache, path, name, **kwargs):
+    key = os.path.abspath(os.path.join(path, name))
+    entry = cache.get(key)
+    fileKey = file_key(path, name)
+    if not entry or {k: entry.get(k) for k in fileKey} != fileKey:
+        entry = {}
+    cache[key] = dict(entry, **kwargs, **fileKey)
+
+
+def get_sha256s(path, names, cache, verify, verbose):
+    """
+    Get the sha256 of a list of files, only hashing files that are not in
+    the digest cache or that have changed since they were cached.
+
+    :param path: the directory of the files.
+    :param names: a list of file names in the directory.
+    :param cache: the digest cache.  This is updated.
+    :param verify: if True, hash every file and report any that differ from
+        the cache.
+    :param verbose: verbosity level.
+    :returns: a list of hex digests in the same order as names.
+    """
+    shas = {}
+    for name in names:
+        entry = cache_entry(cache, path, name)
+        if not verify and entry and entry.get('sha256'):
+            shas[name] = entry['sha256']
+    todo = [name for name in names if name not in shas]
+    if verbose >= 1:
+        print(f'Hashing {len(todo)} of {len(names)} files')
+    if todo:
+        with multiprocessing.Pool() as pool:
+            results = pool.starmap(get_sha256, [(path, name, verbose) for name in todo])
+        if verbose == 1:
+            sys.stdout.write((' ' * 79) + '\r')
+        for name, sha in zip(todo, results):
+            entry = cache_entry(cache, path, name)
+            if verify and entry and entry.get('sha256') not in {None, sha}:
+                print(f'sha256 differs from cache: {name}')
+            shas[name] = sha
+            update_cache(cache, path, name, sha256=sha)
+    return [shas[name] for name in names]
+
+
+def read_metadata(path, name):
+    """
+    Read the core metadata of a wheel.  zipfile only reads the end of the
+    archive, the central directory, and the one member, so this doesn't
+    depend on the size of the wheel.
+
+    :param path: the directory of the wheel.
+    :param name: the wheel file name.
+    :returns: the contents of .dist-info/METADATA as bytes.
+    """
+    with zipfile.ZipFile(os.path.join(path, name)) as zptr:
+        metadata = next(
+            member for member in zptr.namelist()
+            if re.match(r'^[^/]+\.dist-info/METADATA$', member))
+        return zptr.read(metadata)
+
+
+def get_metadata(path, names, cache, verbose):
+    """
+    Write a PEP 658 <wheel>.metadata file next to each wheel and get the
+    Requires-Python value and digest of the metadata.  Wheels that are in
+    the digest cache and whose metadata file exists are not opened.
+
+    :param path: the directory of the wheels.
+    :param names: a list of wheel file names in the directory.
+    :param cache: the digest cache.  This is updated.
+    :param verbose: verbosity level.
+    :returns: a list of dictionaries in the same order as names with
+        requires_python (None if the wheel doesn't specify it) and
+        metadata_sha256.
+    """
+    results = []
+    for name in names:
+        entry = cache_entry(cache, path, name)
+        metaPath = os.path.join(path, name + '.metadata')
+        if (entry is None or 'metadata_sha256' not in entry or
+                not os.path.exists(metaPath) or
+                os.path.getsize(metaPath) != entry.get('metadata_size')):
+            if verbose >= 2:
+                print(f'Extracting metadata from {name}')
+            metadata = read_metadata(path, name)
+            value = email.parser.HeaderParser().parsestr(
+                metadata.decode('utf8')).get('Requires-Python')
+            open(metaPath, 'wb').write(metadata)
+            update_cache(
+                cache, path, name, requires_python=value,
+                metadata_sha256=hashlib.sha256(metadata).hexdigest(),
+                metadata_size=len(metadata))
+            entry = cache_entry(cache, path, name)
+        results.append({
+            'requires_python': entry['requires_python'],
+            'metadata_sha256': entry['metadata_sha256'],
+        })
+    return results
+
+
+def normalize_project(name):
+    """
+    Normalize a project name as per PEP 503.
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def write_simple(path, wpath, prefix, wheels, shas, metadata, verbose):
+    """
+    Write a PEP 503 simple index with a page for each project, and a PEP 691
+    json file next to each page.
+
+    :param path: the root of the index.
+    :param wpath: the directory of the wheels.
+    :param prefix: a prefix for the wheel urls.  If empty, relative urls are
+        used.
+    :param wheels: a list of (name, url) tuples of the wheels.
+    :param shas: a list of sha256 digests of the wheels or None.
+    :param metadata: a list of dictionaries with requires_python and
+        metadata_sha256 of the wheels.
+    :param verbose: verbosity level.
+    :returns: a sorted list of (project, display name) tuples.
+    """
+    projects = {}
+    for idx, (name, url) in enumerate(wheels):
+        projects.setdefault(normalize_project(name.split('-')[0]), []).append(idx)
+    for project, indices in sorted(projects.items()):
+        files = []
+        links = []
+        for idx in indices:
+            name, url = wheels[idx]
+            fileurl = (prefix or '../') + url
+            stat = os.stat(os.path.join(wpath, name))
+            entry = {
+                'filename': name,
+                'url': fileurl,
+                'hashes': {'sha256': shas[idx]} if shas else {},
+                'size': stat.st_size,
+                'upload-time': time.strftime(
+                    '%Y-%m-%dT%H:%M:%SZ', time.gmtime(stat.st_mtime)),
+            }
+            attrs = ''
+            requiresPython = metadata[idx]['requires_python']
+            if requiresPython:
+                entry['requires-python'] = requiresPython
+                attrs += ' data-requires-python="%s"' % html.escape(requiresPython)
+            # PEP 714 renamed the PEP 658 key; older installers only look
+            # for dist-info-metadata, so write both.
+            metaHash = {'sha256': metadata[idx]['metadata_sha256']}
+            entry['core-metadata'] = entry['dist-info-metadata'] = metaHash
+            attrs += ' data-core-metadata="sha256=%s" data-dist-info-metadata="sha256=%s"' % (
+                metaHash['sha256'], metaHash['sha256'])
+            files.append(entry)
+            links.append('<a href="%s%s"%s>%s</a><br/>' % (
+                html.escape(fileurl), '#sha256=' + shas[idx] if shas else '',
+                attrs, html.escape(name)))
+        os.makedirs(os.path.join(path, project), exist_ok=True)
+        if verbose >= 2:
+            print(f'Writing {project}/{indexName}')
+        open(os.path.join(path, project, indexName), 'w').write(simpleTemplate.replace(
+            '%TITLE%', f'Links for {project}').replace('%LINKS%', '\n'.join(links)))
+        json.dump({
+            'meta': {'api-version': simpleApiVersion},
+            'name': project,
+            'files': files,
+            'versions': sorted({wheels[idx][0].split('-')[1] for idx in indices}),
+        }, open(os.path.join(path, project, 'index.json'), 'w'), indent=1)
+    json.dump({
+        'meta': {'api-version': simpleApiVersion},
+        'projects': [{'name': project} for project in sorted(projects)],
+    }, open(os.path.join(path, 'index.json'), 'w'), indent=1)
+    return sorted(projects)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Create an index.html page for wheels')
@@ -59,6 +296,24 @@ if __name__ == '__main__':
     parser.add_argument(
         '--no-sha', action='store_true',
         help='Do not include sha256 in links.')
+    parser.add_argument(
+        '-s', '--simple', action='store_true',
+        help='Also write a PEP 503 simple index with a directory for each '
+        'project containing index.html and a PEP 691 index.json.  The main '
+        'index.html links to each project.  A PEP 658 <wheel>.metadata '
+        'file is written next to each wheel.')
+    parser.add_argument(
+        '--cache',
+        help='The path of a cache of sha256 digests.  Files whose path, size, '
+        'mtime, and inode match the cache are not hashed again.  This '
+        f'defaults to {cacheName} in the directory with the wheels.')
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='Do not read or write the sha256 cache.')
+    parser.add_argument(
+        '--verify', action='store_true',
+        help='Hash every wheel, even if it is in the cache, and report any '
+        'digests that differ from the cache.')
     parser.add_argument(
         '--verbose', '-v', action='count', default=0, help='Increase verbosity')
     args = parser.parse_args()
@@ -89,10 +344,20 @@ if __name__ == '__main__':
         existing = existing.replace('Simple Package Repository', 'large_image_wheels')
         existing = existing.replace('<body>', '<body>\n<h1>large_image_wheels</h1>')
         template = existing.replace('</body>', '<pre>\n%LINKS%\n</pre>\n</body>')
+    cachePath = None if args.no_cache else (args.cache or os.path.join(wpath, cacheName))
+    cache = load_cache(cachePath)
+    shas = None
+    if not args.no_sha:
+        shas = get_sha256s(
+            wpath, [url for name, url in wheels], cache, args.verify, args.verbose)
+    if args.simple:
+        metadata = get_metadata(wpath, [url for name, url in wheels], cache, args.verbose)
+        projects = write_simple(path, wpath, prefix, wheels, shas, metadata, args.verbose)
+        template = template.replace('<pre>', '\n'.join(
+            '<a href="%s/">%s</a><br/>' % (project, project)
+            for project in projects) + '\n<pre>')
+    save_cache(cachePath, cache)
     if not args.no_sha:
-        with multiprocessing.Pool() as pool:
-            shas = list(pool.starmap(get_sha256, [
-                (wpath, url, args.verbose) for name, url in wheels]))
         index = template.replace('%LINKS%', '\n'.join([
             link % (
                 prefix, url, shas[idx], name, name,
@@ -101,8 +366,6 @@ if __name__ == '__main__':
                     os.path.join(wpath, name)))),
                 os.path.getsize(os.path.join(wpath, name)),
             ) for idx, (name, url) in enumerate(wheels)]))
-        if args.verbose == 1:
-            sys.stdout.write((' ' * 79) + '\r')
     else:
         index = template.replace('%LINKS%', '\n'.join([
             linknosha % (
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+# Rewrite wheels so that they are reproducible and small, in one pass:
+# - member timestamps are clamped to SOURCE_DATE_EPOCH,
+# - members are sorted by name with the .dist-info directory last and RECORD
+#   at the very end,
+# - permissions are normalized to 0644 or 0755, and extra fields and
+#   comments are dropped,
+# - members are recompressed in parallel, and stored if that is smaller.
+# This replaces running strip-nondeterminism and then advzip on each wheel.
+#
+# normalize_wheel.py [--level <0-9|zopfli>] [-j <jobs>] <wheel> ...
+# The level defaults to the WHEEL_COMPRESSION environment variable or 9.
+# zopfli requires the zopfli python package.
+# --local-version <label> (default is the WHEEL_LOCAL_VERSION environment
+# variable) adds +<label> to the version of the wheel, renaming the wheel and
+# its .dist-info directory and updating METADATA and RECORD.
+
+import argparse
+import collections
+import concurrent.futures
+import importlib.util
+import io
+import json
+import os
+import re
+import stat
+import threading
+import time
+import zipfile
+import zlib
+
+import fix_record
+
+# zip files can't represent times before 1980
+minimumTime = (1980, 1, 1, 0, 0, 0)
+
+_local = threading.local()
+
+
+def member_order(name):
+    """
+    A sort key for wheel members.
+    """
+    parts = name.split('/')
+    distinfo = len(parts) > 1 and parts[0].endswith('.dist-info')
+    return (distinfo, distinfo and parts[-1] == 'RECORD' and len(parts) == 2, name)
+
+
+def normal_mode(zinfo):
+    """
+    Get the normalized external attributes of a member.
+    """
+    mode = zinfo.external_attr >> 16
+    if zinfo.is_dir():
+        return (stat.S_IFDIR | 0o755) << 16 | 0x10
+    if stat.S_ISLNK(mode):
+        return zinfo.external_attr & 0xFFFF0000
+    return (stat.S_IFREG | (0o755 if mode & 0o111 else 0o644)) << 16
+
+
+def deflate(data, level, iterations=15):
+    """
+    Compress data to a raw deflate stream.
+
+    :param data: the bytes to compress.
+    :param level: 0-9 for zlib or 'zopfli'.
+    :param iterations: the number of zopfli iterations.
+    :returns: the compressed bytes.
+    """
+    if level == 'zopfli':
+        import zopfli.zopfli
+
+        # This produces a zlib stream; remove the 2 byte header and 4 byte
+        # checksum to get the raw deflate stream.
+        return zopfli.zopfli.compress(data, numiterations=iterations)[2:-4]
+    compressor = zlib.compressobj(int(level), zlib.DEFLATED, -15, 9)
+    return compressor.compress(data) + compressor.flush()
+
+
+def local_version_changes(src, path, local):
+    """
+    Work out how to add a local version label to a wheel.
+
+    :param src: the wheel's ZipFile.
+    :param path: the path of the wheel.
+    :param local: the local version label, such as 'throughput'.
+    :returns: the new path of the wheel, a dictionary of renamed members, and
+        a dictionary of new member contents keyed by the original member name.
+        None if the version already has the label.
+    """
+    distinfo = next(
+        name.split('/')[0] for name in src.namelist()
+        if name.count('/') == 1 and name.endswith('.dist-info/METADATA'))
+    project, version = distinfo[:-len('.dist-info')].rsplit('-', 1)
+    existing = version.partition('+')[2]
+    if local in existing.split('.'):
+        return None
+    newVersion = version + ('.' if existing else '+') + local
+    oldPrefix = f'{project}-{version}.'
+    newPrefix = f'{project}-{newVersion}.'
+    renames = {
+        name: newPrefix + name[len(oldPrefix):] for name in src.namelist()
+        if name.startswith((oldPrefix + 'dist-info/', oldPrefix + 'data/'))}
+    metadata = re.sub(
+        r'^Version: .*$', 'Version: ' + newVersion,
+        src.read(distinfo + '/METADATA').decode('utf8'), count=1,
+        flags=re.MULTILINE).encode('utf8')
+    hashval, size = fix_record.record_hash(io.BytesIO(metadata))
+    record = []
+    for row in fix_record.read_record(src.read(distinfo + '/RECORD').decode('utf8')):
+        if row[0] == distinfo + '/METADATA':
+            row = [row[0], hashval, str(size)]
+        record.append([renames.get(row[0], row[0])] + row[1:])
+    contents = {
+        distinfo + '/METADATA': metadata,
+        distinfo + '/RECORD': fix_record.write_record(record).encode('utf8'),
+    }
+    parts = os.path.basename(path).split('-')
+    parts[1] = newVersion
+    return os.path.join(os.path.dirname(path), '-'.join(parts)), renames, contents
+
+
+def compress_member(key, name, level, iterations, data=None):
+    """
+    Read a member of a wheel and recompress it.  This is run in worker
+    threads; each thread keeps its own handle to the wheel.
+
+    :param key: a tuple of the path, inode, and mtime of the wheel.
+    :param name: the member name.
+    :param level: 0-9 for zlib or 'zopfli'.
+    :param iterations: the number of zopfli iterations.
+    :param data: if not None, compress this instead of the member's contents.
+    :returns: the compression type and compressed data.
+    """
+    if data is None:
+        if getattr(_local, 'key', None) != key:
+            if getattr(_local, 'zptr', None):
+                _local.zptr.close()
+            _local.zptr = zipfile.ZipFile(key[0])
+            _local.key = key
+        data = _local.zptr.read(name)
+    if level != 'zopfli' and int(level) == 0:
+        return zipfile.ZIP_STORED, data
+    compressed = deflate(data, level, iterations)
+    if len(compressed) >= len(data):
+        return zipfile.ZIP_STORED, data
+    return zipfile.ZIP_DEFLATED, compressed
+
+
+def write_member(dest, zinfo, compressType, data):
+    """
+    Write an already compressed member to a zip file.
+    """
+    zinfo.compress_type = compressType
+    zinfo.compress_size = len(data)
+    zinfo.header_offset = dest.fp.tell()
+    dest.fp.write(zinfo.FileHeader())
+    dest.fp.write(data)
+    dest.filelist.append(zinfo)
+    dest.NameToInfo[zinfo.filename] = zinfo
+    dest.start_dir = dest.fp.tell()
+
+
+def normalize_wheel(path, pool, jobs, level=9, iterations=15, epoch=None, local=None):
+    """
+    Normalize a wheel in place.
+
+    :param path: the path of the wheel.
+    :param pool: a ThreadPoolExecutor used to compress members.
+    :param jobs: the number of members to compress at once.
+    :param level: 0-9 for zlib or 'zopfli'.
+    :param iterations: the number of zopfli iterations.
+    :param epoch: the latest timestamp allowed.  None to not clamp
+        timestamps.
+    :param local: if not empty, add this local version label to the wheel's
+        version.  The wheel is renamed to match.
+    :returns: a dictionary of results.
+    """
+    start = time.time()
+    dateLimit = time.gmtime(epoch)[:6] if epoch is not None else None
+    tempPath = path + '.tmp'
+    newPath = path
+    try:
+        with zipfile.ZipFile(path) as src, zipfile.ZipFile(tempPath, 'w') as dest:
+            renames, contents = {}, {}
+            changes = local_version_changes(src, path, local) if local else None
+            if changes:
+                newPath, renames, contents = changes
+            infolist = sorted(src.infolist(), key=lambda zinfo: member_order(
+                renames.get(zinfo.filename, zinfo.filename)))
+            pending = collections.deque()
+
+            def write_next():
+                srcinfo, future = pending.popleft()
+                compressType, data = future.result()
+                dateTime = max(srcinfo.date_time, minimumTime)
+                if dateLimit is not None:
+                    dateTime = max(min(dateTime, dateLimit), minimumTime)
+                zinfo = zipfile.ZipInfo(
+                    renames.get(srcinfo.filename, srcinfo.filename), dateTime)
+                zinfo.create_system = 3
+                zinfo.external_attr = normal_mode(srcinfo)
+                if srcinfo.filename in contents:
+                    zinfo.CRC = zlib.crc32(contents[srcinfo.filename])
+                    zinfo.file_size = len(contents[srcinfo.filename])
+                else:
+                    zinfo.CRC = srcinfo.CRC
+                    zinfo.file_size = srcinfo.file_size
+                write_member(dest, zinfo, compressType, data)
+
+            key = (path, os.stat(path).st_ino, os.stat(path).st_mtime_ns)
+            for srcinfo in infolist:
+                pending.append((srcinfo, pool.submit(
+                    compress_member, key, srcinfo.filename, level, iterations,
+                    contents.get(srcinfo.filename))))
+                # Limit how many compressed members are held in memory
+                while len(pending) > jobs:
+                    write_next()
+            while pending:
+                write_next()
+    except Exception:
+        if os.path.exists(tempPath):
+            os.unlink(tempPath)
+        raise
+    result = {
+        'name': os.path.basename(newPath),
+        'before': os.path.getsize(path),
+        'after': os.path.getsize(tempPath),
+    }
+    os.replace(tempPath, newPath)
+    if newPath != path:
+        os.unlink(path)
+    result['saved'] = result['before'] - result['after']
+    result['time'] = time.time() - start
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Make wheels reproducible and recompress them.')
+    parser.add_argument('wheels', nargs='+', help='Wheels to normalize in place.')
+    parser.add_argument(
+        '-l', '--level', default=os.environ.get('WHEEL_COMPRESSION') or '9',
+        choices=[str(level) for level in range(10)] + ['zopfli'],
+        help='The deflate level or zopfli.  0 stores members uncompressed.  '
+        'Default is the WHEEL_COMPRESSION environment variable or 9.')
+    parser.add_argument(
+        '--iterations', type=int, default=15,
+        help='The number of zopfli iterations.')
+    parser.add_argument(
+        '--epoch', type=int,
+        default=int(os.environ['SOURCE_DATE_EPOCH'])
+        if os.environ.get('SOURCE_DATE_EPOCH') else None,
+        help='Clamp timestamps to this time.  Default is the '
+        'SOURCE_DATE_EPOCH environment variable.')
+    parser.add_argument(
+        '--local-version', default=os.environ.get('WHEEL_LOCAL_VERSION') or None,
+        help='Add this local version label (e.g., throughput) to the wheel '
+        'versions.  Default is the WHEEL_LOCAL_VERSION environment variable.')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count(),
+        help='The number of members to compress at once.')
+    parser.add_argument(
+        '--json', help='Write a json report to this path.')
+    parser.add_argument(
+        '--verbose', '-v', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+    if args.level == 'zopfli' and importlib.util.find_spec('zopfli') is None:
+        parser.error('zopfli compression requires the zopfli package')
+    if args.local_version and not re.match(r'^[a-z0-9]+(\.[a-z0-9]+)*$', args.local_version):
+        parser.error('A local version label is lowercase letters and digits '
+                     'separated by periods')
+
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as pool:
+        for path in args.wheels:
+            result = normalize_wheel(
+                path, pool, args.jobs, args.level, args.iterations, args.epoch,
+                args.local_version)
+            results.append(result)
+            if args.verbose >= 1:
+                print('%s: %d -> %d bytes, saved %d (%3.1f%%) in %5.3fs' % (
+                    result['name'], result['before'], result['after'], result['saved'],
+                    100.0 * result['saved'] / max(1, result['before']), result['time']))
+    if args.verbose >= 1 and len(results) > 1:
+        print('Total: saved %d bytes in %5.3fs' % (
+            sum(result['saved'] for result in results),
+            sum(result['time'] for result in results)))
+    if args.json:
+        json.dump(results, open(args.json, 'w'), indent=1)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+# Profile-guided optimization of the tile decoding libraries.  This is opt-in;
+# build_pgo.sh runs the whole process.
+#   pgo.py env <library>
+# prints shell export commands that add compiler and linker flags for the
+# library, based on the PGO environment variable.  With PGO=generate, the
+# library is instrumented to write profiles to /build/pgo-generate/<library>;
+# with PGO=use, it is optimized with the profiles in /build/pgo/<library>.
+# Nothing is printed otherwise.  Use it in a build step as
+#   eval "$(pgo.py env <library>)"
+#   pgo.py train [--fixtures <dir>] [--repeat <n>] [--json <path>]
+# makes tiled, pyramidal test images and decodes them with the libraries' own
+# tools (gdalinfo, vips, tiffcp, opj_decompress, djpeg, dwebp), reporting the
+# time each takes.  In an instrumented image, this writes the profiles.
+#   pgo.py train --python <python> ...
+# instead decodes them through the GDAL, openslide_python, and pyvips wheels
+# installed for that python, so the libraries are the ones the wheels' loader
+# selects (see libs_loader.py and LARGE_IMAGE_WHEELS_ISA).  This is what users
+# get, so compare PGO builds this way.
+#   pgo.py compare <before.json> <after.json> [--json <path>]
+# reports the decode throughput change between two training runs.
+
+import argparse
+import json
+import math
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+generateRoot = '/build/pgo-generate'
+useRoot = '/build/pgo'
+
+# The source image is made of sines and noise in each band so that it
+# compresses like a real image rather than a flat one.
+imageSize = 4096
+fixtures = {
+    'jpeg.tif': ['tiffsave', '--tile', '--pyramid', '--tile-width', '256',
+                 '--tile-height', '256', '--compression', 'jpeg', '--Q', '90'],
+    'webp.tif': ['tiffsave', '--tile', '--pyramid', '--tile-width', '256',
+                 '--tile-height', '256', '--compression', 'webp', '--Q', '90'],
+    'zstd.tif': ['tiffsave', '--tile', '--pyramid', '--tile-width', '256',
+                 '--tile-height', '256', '--compression', 'zstd'],
+    'deflate.tif': ['tiffsave', '--tile', '--pyramid', '--tile-width', '256',
+                    '--tile-height', '256', '--compression', 'deflate'],
+    'jp2k.tif': ['tiffsave', '--tile', '--pyramid', '--tile-width', '256',
+                 '--tile-height', '256', '--compression', 'jp2k', '--Q', '90'],
+    'image.jp2': ['jp2ksave', '--tile-width', '256', '--tile-height', '256', '--Q', '90'],
+    'image.jpg': ['jpegsave', '--Q', '90'],
+    'image.webp': ['webpsave', '--Q', '90'],
+}
+tiffFixtures = ['jpeg.tif', 'webp.tif', 'zstd.tif', 'deflate.tif', 'jp2k.tif']
+# Each workload is a name, a fixture, and a command.  {path} is the fixture
+# and {out} is a scratch path without an extension.
+workloads = [
+    (f'tiffcp {name}', name, ['tiffcp', '-c', 'none', '{path}', '{out}.tif'])
+    for name in tiffFixtures
+] + [
+    (f'gdal {name}', name, ['gdalinfo', '-checksum', '-nomd', '-noct', '{path}'])
+    for name in tiffFixtures + ['image.jp2']
+] + [
+    (f'vips {name}', name, ['vips', 'avg', '{path}'])
+    for name in tiffFixtures + ['image.jp2', 'image.jpg', 'image.webp']
+] + [
+    ('openslide jpeg.tif', 'jpeg.tif', ['vips', 'openslideload', '{path}', '{out}.v']),
+    ('openslide webp.tif', 'webp.tif', ['vips', 'openslideload', '{path}', '{out}.v']),
+    ('opj_decompress image.jp2', 'image.jp2',
+     ['opj_decompress', '-i', '{path}', '-o', '{out}.raw']),
+    ('djpeg image.jpg', 'image.jpg', ['djpeg', '-outfile', '{out}.ppm', '{path}']),
+    ('dwebp image.webp', 'image.webp', ['dwebp', '{path}', '-ppm', '-o', '{out}.ppm']),
+]
+
+# Each wheel workload is a name, a fixture, the module to import, and code
+# that decodes the fixture at path.
+wheelWorkloads = [
+    (f'osgeo {name}', name, 'osgeo.gdal',
+     'ds = osgeo.gdal.Open(path)\n'
+     '[ds.GetRasterBand(band + 1).Checksum() for band in range(ds.RasterCount)]')
+    for name in tiffFixtures + ['image.jp2']
+] + [
+    (f'pyvips {name}', name, 'pyvips', 'pyvips.Image.new_from_file(path).avg()')
+    for name in tiffFixtures + ['image.jp2', 'image.jpg', 'image.webp']
+] + [
+    (f'openslide {name}', name, 'openslide',
+     'slide = openslide.OpenSlide(path)\n'
+     'width, height = slide.dimensions\n'
+     'for y in range(0, height, 1024):\n'
+     '    for x in range(0, width, 1024):\n'
+     '        slide.read_region((x, y), 0, (1024, 1024))')
+    for name in ['jpeg.tif', 'webp.tif']
+]
+# This prints the decode time, excluding the import, and the variant the
+# loader selected.
+wheelScript = '''import os
+import sys
+import time
+import {module}
+from {package} import _libs_loader
+path = sys.argv[1]
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+variants = {{os.path.basename(value) for value in _libs_loader._selected.values() if value}}
+print(elapsed, ','.join(sorted(variants)) or 'baseline')
+'''
+
+
+def pgo_flags(library, mode=None):
+    """
+    Get the compiler flags for a library.
+
+    :param library: the library name, used as the profile directory.
+    :param mode: 'generate', 'use', or anything else for no flags.  Defaults
+        to the PGO environment variable.
+    :returns: a string of flags.
+    """
+    mode = os.environ.get('PGO', '') if mode is None else mode
+    if mode == 'generate':
+        return (f'-fprofile-generate={generateRoot}/{library} '
+                '-fprofile-update=atomic')
+    if mode == 'use':
+        path = os.path.join(useRoot, library)
+        if not os.path.isdir(path) or not os.listdir(path):
+            print(f'No profiles for {library} in {path}', file=sys.stderr)
+            return ''
+        # Partial training keeps code that the workload doesn't reach
+        # optimized normally rather than for size.
+        return (f'-fprofile-use={path} -fprofile-partial-training '
+                '-fprofile-correction -Wno-missing-profile -Wno-coverage-mismatch')
+    return ''
+
+
+def run(cmd, **kwargs):
+    kwargs.setdefault('stdout', subprocess.DEVNULL)
+    return subprocess.run(cmd, stderr=subprocess.PIPE, **kwargs)
+
+
+def make_fixtures(path, verbose=0):
+    """
+    Make any fixtures that don't already exist.
+
+    :param path: the fixture directory.
+    :param verbose: verbosity level.
+    :returns: a list of fixtures that couldn't be made.
+    """
+    path = os.path.abspath(path)
+    os.makedirs(path, exist_ok=True)
+    missing = [name for name in fixtures if not os.path.exists(os.path.join(path, name))]
+    if not missing:
+        return []
+    if not shutil.which('vips'):
+        print('vips is needed to make the fixtures', file=sys.stderr)
+        return missing
+    failed = []
+    with tempfile.TemporaryDirectory(prefix='pgo_') as tempdir:
+        bands = []
+        for band, (hfreq, vfreq) in enumerate([(3, 5), (7, 2), (11, 13)]):
+            steps = [
+                ['sines', f'sines{band}.v', str(imageSize), str(imageSize),
+                 '--hfreq', str(hfreq), '--vfreq', str(vfreq)],
+                ['gaussnoise', f'noise{band}.v', str(imageSize), str(imageSize),
+                 '--mean', '128', '--sigma', '24'],
+                ['linear', f'sines{band}.v', f'scaled{band}.v', '80', '0'],
+                ['add', f'scaled{band}.v', f'noise{band}.v', f'sum{band}.v'],
+                ['cast', f'sum{band}.v', f'band{band}.v', 'uchar'],
+            ]
+            for step in steps:
+                subprocess.check_call(['vips'] + step, cwd=tempdir)
+            bands.append(f'band{band}.v')
+        subprocess.check_call(['vips', 'bandjoin', ' '.join(bands), 'source.v'], cwd=tempdir)
+        for name in missing:
+            options = fixtures[name]
+            dest = os.path.join(path, name)
+            tempPath = os.path.join(tempdir, name)
+            proc = run(['vips', options[0], 'source.v', tempPath] + options[1:], cwd=tempdir)
+            if proc.returncode:
+                failed.append(name)
+                if verbose >= 1:
+                    print(f'Failed to make {name}: {proc.stderr.decode(errors="replace")}')
+                continue
+            shutil.move(tempPath, dest)
+            if verbose >= 1:
+                print(f'Made {name} ({os.path.getsize(dest)} bytes)')
+    return failed
+
+
+def train(fixturePath, repeat=3, verbose=0, python=None):
+    """
+    Decode the fixtures with each workload.
+
+    :param fixturePath: the fixture directory.
+    :param repeat: the number of times to run each workload.
+    :param verbose: verbosity level.
+    :param python: if set, decode through the wheels installed for this
+        python rather than with the libraries' tools.
+    :returns: a dictionary of results keyed by workload name.  Each has the
+        median and minimum time and megapixels per second, or a reason the
+        workload was skipped.  Wheel workloads also have the variant the
+        loader selected.
+    """
+    results = {}
+    if python:
+        selected = [
+            (name, fixture, [python, '-c', wheelScript.format(
+                module=module, package=module.split('.')[0], code=code), '{path}'])
+            for name, fixture, module, code in wheelWorkloads]
+    else:
+        selected = workloads
+    with tempfile.TemporaryDirectory(prefix='pgo_') as tempdir:
+        for name, fixture, cmd in selected:
+            path = os.path.join(fixturePath, fixture)
+            if not os.path.exists(path):
+                results[name] = {'skipped': f'no {fixture}'}
+                continue
+            if not shutil.which(cmd[0]):
+                results[name] = {'skipped': f'no {cmd[0]}'}
+                continue
+            cmd = [part.replace('{path}', path).replace('{out}', os.path.join(tempdir, 'out'))
+                   for part in cmd]
+            times = []
+            variant = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                proc = run(cmd, stdout=subprocess.PIPE) if python else run(cmd)
+                times.append(time.perf_counter() - start)
+                if proc.returncode:
+                    break
+                if python:
+                    elapsed, variant = proc.stdout.decode().split()[-2:]
+                    times[-1] = float(elapsed)
+            for entry in os.listdir(tempdir):
+                os.unlink(os.path.join(tempdir, entry))
+            if proc.returncode:
+                results[name] = {'skipped': proc.stderr.decode(errors='replace').strip()[-200:]}
+            else:
+                times.sort()
+                median = times[len(times) // 2]
+                results[name] = {
+                    'median': median, 'min': times[0],
+                    'mpixels_per_second': imageSize * imageSize / 1e6 / median,
+                    'command': ' '.join(shlex.quote(part) for part in cmd)}
+                if variant:
+                    results[name]['variant'] = variant
+            if verbose >= 1:
+                result = results[name]
+                print('%-28s %s' % (name, 'skipped: %s' % result['skipped']
+                                    if 'skipped' in result else '%7.3fs %8.1f Mpixel/s' % (
+                                        result['median'], result['mpixels_per_second'])))
+    return results
+
+
+def compare(before, after):
+    """
+    Compare two training runs.
+
+    :param before: the results of the baseline run.
+    :param after: the results of the optimized run.
+    :returns: a dictionary with the speedup of each workload both runs
+        completed and their geometric mean.  A speedup above 1 is faster.
+    """
+    speedups = {
+        name: before[name]['median'] / after[name]['median']
+        for name in before
+        if name in after and 'median' in before[name] and 'median' in after[name]
+        and after[name]['median'] > 0}
+    geomean = math.exp(sum(math.log(value) for value in speedups.values()) /
+                       len(speedups)) if speedups else None
+    return {'speedups': speedups, 'geomean': geomean}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Profile-guided optimization of the decoding libraries.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    envParser = sub.add_parser('env', help='Print flags for a library build.')
+    envParser.add_argument('library')
+    trainParser = sub.add_parser('train', help='Run the training workload.')
+    trainParser.add_argument(
+        '--fixtures', default='/tmp/pgo_fixtures',
+        help='The directory of test images.  Missing images are made.')
+    trainParser.add_argument(
+        '--repeat', type=int, default=3, help='Times to run each workload.')
+    trainParser.add_argument('--json', help='Write results to this path.')
+    trainParser.add_argument(
+        '--python', help='Decode through the wheels installed for this python '
+        'rather than with the libraries\' tools.')
+    trainParser.add_argument(
+        '--verbose', '-v', action='count', default=0, help='Increase verbosity')
+    compareParser = sub.add_parser('compare', help='Compare two training runs.')
+    compareParser.add_argument('before', help='The json results without PGO.')
+    compareParser.add_argument('after', help='The json results with PGO.')
+    compareParser.add_argument('--json', help='Write the comparison to this path.')
+    args = parser.parse_args()
+
+    if args.command == 'env':
+        flags = pgo_flags(args.library)
+        if flags:
+            for var in ('CFLAGS', 'CXXFLAGS', 'LDFLAGS'):
+                print(f'export {var}="${var} {flags}"')
+    elif args.command == 'train':
+        make_fixtures(args.fixtures, args.verbose)
+        results = train(args.fixtures, args.repeat, args.verbose, args.python)
+        if args.json:
+            json.dump(results, open(args.json, 'w'), indent=1)
+    else:
+        before = json.load(open(args.before))
+        after = json.load(open(args.after))
+        comparison = compare(before, after)
+        for name, speedup in comparison['speedups'].items():
+            print('%-28s %7.3fs -> %7.3fs  %+6.1f%%' % (
+                name, before[name]['median'], after[name]['median'], (speedup - 1) * 100))
+        if comparison['geomean']:
+            print('%-28s %+6.1f%% decode throughput' % (
+                'geometric mean', (comparison['geomean'] - 1) * 100))
+        if args.json:
+            json.dump(comparison, open(args.json, 'w'), indent=1)
@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+
+# Move the libraries that several binding wheels bundle into one shared
+# large_image_libs wheel.  This is opt-in (see SHARED_LIBS in the Dockerfile).
+#   shared_libs.py build <wheel> ... --output <dir> [-v]
+# finds the libraries in the wheels' <package>.libs directories that at least
+# two projects bundle with identical contents (auditwheel names them by their
+# contents, so identical libraries have identical names) and whose bundled
+# dependencies are shared too.  These are written to a large_image_libs wheel
+# as large_image_libs.libs/<name>, and copies of the binding wheels without
+# them are written to the output directory.  In the copies, every ELF file
+# that needs a shared library has large_image_libs.libs added to its rpath,
+# and METADATA requires the exact version of large_image_libs.  That version
+# is the time versions.txt was last committed, which increases whenever a
+# library version changes, with a hash of versions.txt as its local label
+# (e.g., 2026.1018.103900+3f2a9c81d0).  The time is from --versions-epoch or
+# the VERSIONS_EPOCH environment variable (build.sh passes it to the
+# Dockerfile), or from git.  The copies keep the names of the original
+# wheels; add a local version label to them with
+#   normalize_wheel.py --local-version shared <wheel> ...
+# (as the Dockerfile does) so that they can't be mistaken for the originals.
+#   shared_libs.py measure <before dir> <after dir> [--json <path>] [-v]
+# installs the GDAL, mapnik, openslide_python, and pyvips wheels from each
+# directory into virtualenvs and compares the install size and the resident
+# memory of importing all of them.
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import posixpath
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+import fix_record
+
+libsName = 'large_image_libs'
+libsDir = libsName + '.libs'
+projects = ['GDAL', 'mapnik', 'openslide_python', 'pyvips']
+# Statements that import the projects in the measure command
+imports = 'from osgeo import gdal; import mapnik, openslide, pyvips'
+# <project>-<version>-<python tag>-<abi tag>-<platform tag>.whl
+wheelName = re.compile(
+    r'^(?P<project>[^-]+)-(?P<version>[^-]+)-(?P<python>[^-]+)-[^-]+-(?P<platform>[^-]+)\.whl$')
+
+
+def restore_mode(path, zinfo):
+    """
+    Set the permissions of an extracted member to those in the wheel.
+    ZipFile.extract doesn't, and fix_record takes the mode from the file.
+
+    :param path: the path of the extracted member.
+    :param zinfo: the member's ZipInfo.
+    """
+    mode = zinfo.external_attr >> 16 & 0o7777
+    if mode:
+        os.chmod(path, mode)
+
+
+def versions_epoch(versionsPath):
+    """
+    Get the time versions.txt was last committed.
+
+    :param versionsPath: the path of versions.txt.
+    :returns: the commit time in seconds since the epoch.
+    """
+    try:
+        epoch = subprocess.check_output(
+            ['git', 'log', '-1', '--format=%ct', '--', os.path.basename(versionsPath)],
+            cwd=os.path.dirname(os.path.abspath(versionsPath)),
+            stderr=subprocess.DEVNULL, encoding='utf8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        epoch = ''
+    if not epoch:
+        raise ValueError(
+            f'Can\'t get the commit time of {versionsPath}; pass --versions-epoch '
+            'or set VERSIONS_EPOCH')
+    return int(epoch)
+
+
+def libs_version(versionsPath, epoch):
+    """
+    Get the version of the large_image_libs wheel.  Versions from later
+    commits of versions.txt sort higher, and the local label identifies the
+    exact library versions.
+
+    :param versionsPath: the path of versions.txt.
+    :param epoch: the time versions.txt was committed in seconds since the
+        epoch.
+    :returns: a version string.
+    """
+    with open(versionsPath, 'rb') as fptr:
+        digest = hashlib.sha256(fptr.read()).hexdigest()
+    # Segments are built as numbers so they have no leading zeros
+    committed = time.gmtime(epoch)
+    version = '%d.%d.%d+%s' % (
+        committed.tm_year, committed.tm_mon * 100 + committed.tm_mday,
+        committed.tm_hour * 10000 + committed.tm_min * 100 + committed.tm_sec, digest[:10])
+    if os.environ.get('WHEEL_LOCAL_VERSION'):
+        version += '.' + os.environ['WHEEL_LOCAL_VERSION']
+    return version
+
+
+def needed(path):
+    return subprocess.check_output(
+        ['patchelf', '--print-needed', path], encoding='utf8').split()
+
+
+def is_elf(zptr, name):
+    with zptr.open(name) as fptr:
+        return fptr.read(4) == b'\x7fELF'
+
+
+def bundled_libraries(wheels, tempdir):
+    """
+    Extract the libraries bundled in wheels.
+
+    :param wheels: a list of wheel paths.
+    :param tempdir: a directory for the extracted libraries.
+    :returns: a dictionary of library names, each with the set of projects
+        that bundle it, the set of sha256 digests of its contents, whether any
+        wheel has instruction set variants of it, the path of an extracted
+        copy, and the names of the libraries it needs.
+    """
+    libs = {}
+    for wheel in wheels:
+        project = wheelName.match(os.path.basename(wheel)).group('project')
+        with zipfile.ZipFile(wheel) as zptr:
+            for name in zptr.namelist():
+                parts = name.split('/')
+                if len(parts) < 2 or not parts[0].endswith('.libs') or not parts[-1]:
+                    continue
+                entry = libs.setdefault(parts[-1], {
+                    'projects': set(), 'digests': set(), 'variants': False})
+                if len(parts) > 2:
+                    entry['variants'] = True
+                    continue
+                entry['projects'].add(project)
+                data = zptr.read(name)
+                digest = hashlib.sha256(data).hexdigest()
+                if digest not in entry['digests']:
+                    entry['digests'].add(digest)
+                    entry['path'] = os.path.join(tempdir, parts[1])
+                    with open(entry['path'], 'wb') as fptr:
+                        fptr.write(data)
+                    restore_mode(entry['path'], zptr.getinfo(name))
+    for entry in libs.values():
+        entry['needed'] = needed(entry['path']) if 'path' in entry else []
+    return libs
+
+
+def shared_libraries(libs):
+    """
+    Choose the libraries to share.
+
+    :param libs: a dictionary from bundled_libraries.
+    :returns: a sorted list of library names.
+    """
+    shared = {
+        name for name, entry in libs.items()
+        if len(entry['projects']) > 1 and len(entry['digests']) == 1
+        and not entry['variants']}
+    # A shared library can only depend on other shared libraries
+    while True:
+        remove = {name for name in shared
+                  if any(dep in libs and dep not in shared for dep in libs[name]['needed'])}
+        if not remove:
+            return sorted(shared)
+        shared -= remove
+
+
+def add_requirement(metadata, requirement):
+    """
+    Add a Requires-Dist line to the end of the headers of a METADATA file.
+
+    :param metadata: the METADATA contents.
+    :param requirement: the requirement, e.g.,
+        'large_image_libs==2026.1018.103900+3f2a9c81d0'.
+    :returns: the new METADATA contents.
+    """
+    headers, sep, body = metadata.partition('\n\n')
+    return headers.rstrip('\n') + '\nRequires-Dist: ' + requirement + '\n' + (
+        '\n' + body if sep else '')
+
+
+def rewrite_binding(wheel, shared, version, output, tempdir, verbose=0):
+    """
+    Write a copy of a binding wheel that uses the shared libraries.
+
+    :param wheel: the path of the binding wheel.
+    :param shared: a list of the shared library names.
+    :param version: the version of large_image_libs to require.
+    :param output: the output directory.
+    :param tempdir: a directory for modified files.
+    :param verbose: verbosity level.
+    :returns: the path of the new wheel.
+    """
+    excludes = []
+    additions = []
+    workdir = tempfile.mkdtemp(dir=tempdir)
+    with zipfile.ZipFile(wheel) as zptr:
+        for name in zptr.namelist():
+            parts = name.split('/')
+            if len(parts) == 2 and parts[0].endswith('.libs') and parts[1] in shared:
+                excludes.append(name)
+                continue
+            if name.endswith('/') or not is_elf(zptr, name):
+                if len(parts) == 2 and parts[0].endswith('.dist-info') and parts[1] == 'METADATA':
+                    path = os.path.join(workdir, name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'w', encoding='utf8') as fptr:
+                        fptr.write(add_requirement(
+                            zptr.read(name).decode('utf8'), f'{libsName}=={version}'))
+                    additions.append((name, path))
+                continue
+            path = zptr.extract(name, workdir)
+            restore_mode(path, zptr.getinfo(name))
+            if not set(needed(path)) & set(shared):
+                os.unlink(path)
+                continue
+            if parts[0].endswith('.data'):
+                print(f'{wheel}: {name} is installed outside of site-packages; its rpath '
+                      'can\'t find the shared libraries', file=sys.stderr)
+            rpath = subprocess.check_output(
+                ['patchelf', '--print-rpath', path], encoding='utf8').strip()
+            relpath = posixpath.relpath(libsDir, posixpath.dirname(name))
+            rpath = ':'.join([entry for entry in rpath.split(':') if entry] + [
+                '$ORIGIN/' + relpath])
+            subprocess.check_call(['patchelf', '--set-rpath', rpath, path])
+            additions.append((name, path))
+            if verbose >= 2:
+                print(f'{wheel}: {name} rpath {rpath}')
+    dest = os.path.join(output, os.path.basename(wheel))
+    fix_record.fix_wheel(wheel, additions, excludes, dest)
+    shutil.rmtree(workdir)
+    if verbose >= 1:
+        print(f'{dest}: moved {len(excludes)} libraries to {libsName}')
+    return dest
+
+
+def write_libs_wheel(libs, shared, version, platform, versionsPath, epoch, output):
+    """
+    Write the large_image_libs wheel.
+
+    :param libs: a dictionary from bundled_libraries.
+    :param shared: a list of the shared library names.
+    :param version: the version of the wheel.
+    :param platform: the platform tag, e.g., manylinux_2_28_x86_64.
+    :param versionsPath: the path of versions.txt, which is included in the
+        wheel.
+    :param epoch: the time versions.txt was committed.
+    :param output: the output directory.
+    :returns: the path of the wheel.
+    """
+    tag = f'py3-none-{platform}'
+    path = os.path.join(output, f'{libsName}-{version}-{tag}.whl')
+    distinfo = f'{libsName}-{version}.dist-info'
+    files = {f'{libsDir}/{name}': libs[name]['path'] for name in shared}
+    files[f'{libsName}/versions.txt'] = versionsPath
+    texts = {
+        f'{libsName}/__init__.py': (
+            '# The libraries shared by the large_image binding wheels are in\n'
+            f'# site-packages/{libsDir}\n'
+            'import os\n\n'
+            'libsdir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(\n'
+            f'    __file__))), {libsDir!r})\n'),
+        f'{distinfo}/METADATA': (
+            'Metadata-Version: 2.1\n'
+            f'Name: {libsName}\n'
+            f'Version: {version}\n'
+            'Summary: Native libraries shared by the large_image binding wheels\n'
+            'Home-page: https://github.com/girder/large_image_wheels\n\n'
+            'The library versions are listed in large_image_libs/versions.txt.\n'),
+        f'{distinfo}/WHEEL': (
+            'Wheel-Version: 1.0\n'
+            'Generator: shared_libs.py\n'
+            'Root-Is-Purelib: false\n' +
+            ''.join(f'Tag: py3-none-{part}\n' for part in platform.split('.'))),
+    }
+    # The text files get the date versions.txt was committed so that the
+    # wheel only changes when the libraries do.
+    dateTime = max(time.gmtime(epoch)[:6], (1980, 1, 1, 0, 0, 0))
+    record = []
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zptr:
+        for name, filepath in sorted(files.items()):
+            zinfo = zipfile.ZipInfo.from_file(filepath, name)
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            with open(filepath, 'rb') as src, zptr.open(zinfo, 'w') as dest:
+                shutil.copyfileobj(src, dest)
+            record.append([name, *map(str, fix_record.hash_file(filepath))])
+        texts[f'{distinfo}/RECORD'] = None
+        for name, text in texts.items():
+            if text is None:
+                record.append([name, '', ''])
+                text = fix_record.write_record(record)
+            else:
+                data = text.encode('utf8')
+                record.append([name, *map(str, fix_record.record_hash(io.BytesIO(data)))])
+            zinfo = zipfile.ZipInfo(name, dateTime)
+            zinfo.external_attr = 0o644 << 16
+            zptr.writestr(zinfo, text, zipfile.ZIP_DEFLATED)
+    return path
+
+
+def build(wheels, output, versionsPath, verbose=0, epoch=None):
+    """
+    Make the large_image_libs wheel and copies of binding wheels that use it.
+
+    :param wheels: a list of repaired binding wheels.
+    :param output: the output directory.
+    :param versionsPath: the path of versions.txt.
+    :param verbose: verbosity level.
+    :param epoch: the time versions.txt was committed.  None to get it from
+        git.
+    :returns: a list of the written wheels.
+    """
+    platforms = {wheelName.match(os.path.basename(wheel)).group('platform') for wheel in wheels}
+    if len(platforms) != 1:
+        raise ValueError(f'The wheels have different platforms: {sorted(platforms)}')
+    os.makedirs(output, exist_ok=True)
+    if epoch is None:
+        epoch = versions_epoch(versionsPath)
+    version = libs_version(versionsPath, epoch)
+    with tempfile.TemporaryDirectory(prefix='shared_') as tempdir:
+        libdir = os.path.join(tempdir, 'libs')
+        os.makedirs(libdir)
+        libs = bundled_libraries(wheels, libdir)
+        shared = shared_libraries(libs)
+        if verbose >= 1:
+            size = sum(os.path.getsize(libs[name]['path']) for name in shared)
+            print(f'Sharing {len(shared)} of {len(libs)} libraries ({size} bytes) '
+                  f'as {libsName} {version}')
+        if verbose >= 2:
+            for name in shared:
+                print(f'  {name}: {", ".join(sorted(libs[name]["projects"]))}')
+        written = [write_libs_wheel(
+            libs, shared, version, platforms.pop(), versionsPath, epoch, output)]
+        for wheel in wheels:
+            written.append(rewrite_binding(wheel, shared, version, output, tempdir, verbose))
+    return written
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _dirs, names in os.walk(path) for name in names
+        if not os.path.islink(os.path.join(root, name)))
+
+
+# This runs in the virtualenv.  It prints a json record.
+memoryScript = '''
+import json, os
+%s
+objects = set()
+with open('/proc/self/maps') as fptr:
+    for line in fptr:
+        parts = line.split(None, 5)
+        if len(parts) == 6 and '.so' in os.path.basename(parts[5].strip()):
+            objects.add(parts[5].strip())
+status = dict(line.split(':', 1) for line in open('/proc/self/status'))
+print(json.dumps({
+    'rss_kb': int(status['VmRSS'].split()[0]),
+    'shared_objects': len(objects),
+    'shared_object_bytes': sum(os.path.getsize(path) for path in objects if os.path.exists(path)),
+}))
+''' % imports
+
+
+def measure_directory(wheeldir, repeat=3, verbose=0):
+    """
+    Install the binding wheels in a directory into a new virtualenv and
+    measure them.
+
+    :param wheeldir: a directory of wheels.
+    :param repeat: the number of processes to measure memory in.
+    :param verbose: verbosity level.
+    :returns: a dictionary with the installed bytes, the median resident
+        memory after importing the projects, and the shared objects mapped.
+    """
+    pins = {}
+    for name in os.listdir(wheeldir):
+        match = wheelName.match(name)
+        if match and match.group('project') in projects:
+            pins[match.group('project')] = match.group('version')
+    with tempfile.TemporaryDirectory(prefix='measure_') as venv:
+        subprocess.check_call([sys.executable, '-m', 'venv', venv])
+        python = os.path.join(venv, 'bin', 'python')
+        sitePackages = subprocess.check_output(
+            [python, '-c', 'import sysconfig; print(sysconfig.get_paths()["platlib"])'],
+            encoding='utf8').strip()
+        baseSize = directory_size(sitePackages)
+        subprocess.check_call(
+            [python, '-m', 'pip', 'install', '-q', '--find-links', wheeldir] +
+            [f'{project}=={version}' for project, version in sorted(pins.items())],
+            stdout=None if verbose >= 2 else subprocess.DEVNULL)
+        installed = directory_size(sitePackages) - baseSize
+        runs = [json.loads(subprocess.check_output(
+            [python, '-c', memoryScript], encoding='utf8').strip().splitlines()[-1])
+            for _ in range(repeat)]
+    runs.sort(key=lambda run: run['rss_kb'])
+    result = dict(runs[len(runs) // 2])
+    result['installed_bytes'] = installed
+    result['versions'] = pins
+    return result
+
+
+def measure(before, after, repeat=3, verbose=0):
+    """
+    Compare binding wheels without and with the shared libraries.
+
+    :param before: a directory of the original wheels.
+    :param after: a directory of the wheels from the build command.
+    :param repeat: the number of processes to measure memory in.
+    :param verbose: verbosity level.
+    :returns: a dictionary with the before and after measurements.
+    """
+    results = {
+        'before': measure_directory(before, repeat, verbose),
+        'after': measure_directory(after, repeat, verbose),
+    }
+    results['change'] = {
+        key: results['after'][key] - results['before'][key]
+        for key in ('installed_bytes', 'rss_kb', 'shared_objects', 'shared_object_bytes')}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Share the libraries bundled in several wheels.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    buildParser = sub.add_parser(
+        'build', help='Make large_image_libs and binding wheels that use it.')
+    buildParser.add_argument('wheels', nargs='+', help='Repaired binding wheels.')
+    buildParser.add_argument(
+        '--output', '-o', required=True,
+        help='The directory for the new wheels.  The original wheels are not '
+        'modified.')
+    buildParser.add_argument(
+        '--versions', default='versions.txt' if os.path.exists('versions.txt')
+        else '/build/versions.txt', help='The versions.txt file.')
+    buildParser.add_argument(
+        '--versions-epoch', type=int,
+        default=int(os.environ['VERSIONS_EPOCH'])
+        if os.environ.get('VERSIONS_EPOCH') else None,
+        help='The time versions.txt was last committed in seconds since the '
+        'epoch, which sets the version of large_image_libs.  Default is the '
+        'VERSIONS_EPOCH environment variable or the time from git.')
+    measureParser = sub.add_parser(
+        'measure', help='Compare the install size and memory of two sets of wheels.')
+    measureParser.add_argument('before', help='A directory of the original wheels.')
+    measureParser.add_argument('after', help='A directory of the shared library wheels.')
+    measureParser.add_argument(
+        '--repeat', type=int, default=3, help='Times to measure memory.')
+    measureParser.add_argument('--json', help='Write the results to this path.')
+    for subparser in (buildParser, measureParser):
+        subparser.add_argument(
+            '--verbose', '-v', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        try:
+            build(args.wheels, args.output, args.versions, args.verbose, args.versions_epoch)
+        except ValueError as exc:
+            parser.error(str(exc))
+    else:
+        results = measure(args.before, args.after, args.repeat, args.verbose)
+        for key, scale, unit in (
+                ('installed_bytes', 1024 ** 2, 'MB'), ('rss_kb', 1024, 'MB'),
+                ('shared_objects', 1, ''), ('shared_object_bytes', 1024 ** 2, 'MB')):
+            print('%-20s %10.1f%s -> %10.1f%s  %+6.1f%%' % (
+                key, results['before'][key] / scale, unit, results['after'][key] / scale,
+                unit, (results['after'][key] / results['before'][key] - 1) * 100))
+        if args.json:
+            with open(args.json, 'w') as fptr:
+                json.dump(results, fptr, indent=1)
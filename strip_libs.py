@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+# Strip shared and static libraries before building wheels.
+#   strip_libs.py [<directory> ...] [-j <jobs>] [-v]
+# This is equivalent to running
+#   strip -p -D --strip-unneeded <lib> -o <temp>
+# on each *.so and *.a file under the directories (default /usr/local) and
+# replacing the library if the result differs.  The sha256 of each processed
+# library is recorded, so libraries that an earlier build step already
+# stripped are skipped.  Libraries are stripped concurrently, each to its own
+# temporary file.
+
+import argparse
+import concurrent.futures
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+defaultRecord = '/build/strip_record.json'
+stripArgs = ['-p', '-D', '--strip-unneeded']
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as fptr:
+        while True:
+            data = fptr.read(1024 ** 2)
+            if not len(data):
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def find_libraries(roots, patterns):
+    """
+    Find libraries to strip.  Symlinks are resolved, so each file is only
+    listed once.
+
+    :param roots: a list of directories to search.
+    :param patterns: a list of file name glob patterns.
+    :returns: a sorted list of paths.
+    """
+    paths = set()
+    for root in roots:
+        for dirpath, _dirs, names in os.walk(root):
+            for name in names:
+                if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                    path = os.path.realpath(os.path.join(dirpath, name))
+                    if os.path.isfile(path):
+                        paths.add(path)
+    return sorted(paths)
+
+
+def record_entry(path, **kwargs):
+    stat = os.stat(path)
+    return dict(kwargs, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def is_recorded(path, record):
+    """
+    Check if a library is unchanged since it was last processed.  If its
+    size and mtime match, it isn't read.
+    """
+    entry = record.get(path)
+    if not entry:
+        return False
+    stat = os.stat(path)
+    if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    return entry['size'] == stat.st_size and entry['sha256'] == file_sha256(path)
+
+
+def strip_library(path, strip='strip'):
+    """
+    Strip a library, replacing it if the result differs.
+
+    :param path: the path of the library.
+    :param strip: the strip executable.
+    :returns: a dictionary with the status ('stripped', 'unchanged', or
+        'failed') and the sizes before and after.
+    """
+    before = os.path.getsize(path)
+    fd, tempPath = tempfile.mkstemp(prefix='strip_', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        proc = subprocess.run(
+            [strip] + stripArgs + [path, '-o', tempPath],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if proc.returncode:
+            status = 'failed'
+        elif file_sha256(tempPath) == file_sha256(path):
+            status = 'unchanged'
+        else:
+            # Copy the contents rather than renaming so that the library
+            # keeps its inode and permissions, as cp does.
+            shutil.copyfile(tempPath, path)
+            status = 'stripped'
+    finally:
+        # strip removes its output if it fails
+        if os.path.exists(tempPath):
+            os.unlink(tempPath)
+    return {'status': status, 'before': before, 'after': os.path.getsize(path)}
+
+
+def strip_libraries(paths, record, jobs=None, strip='strip', verbose=0):
+    """
+    Strip libraries that aren't in the record.
+
+    :param paths: a list of library paths.
+    :param record: a dictionary of processed libraries.  This is updated.
+    :param jobs: the number of libraries to strip at once.
+    :param strip: the strip executable.
+    :param verbose: verbosity level.
+    :returns: a dictionary of counts and bytes.
+    """
+    results = {
+        'files': len(paths), 'skipped': 0, 'stripped': 0, 'unchanged': 0,
+        'failed': 0, 'bytes_before': 0, 'bytes_after': 0}
+    todo = []
+    for path in paths:
+        if is_recorded(path, record):
+            results['skipped'] += 1
+        else:
+            todo.append(path)
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        for path, result in zip(todo, pool.map(lambda path: strip_library(path, strip), todo)):
+            results[result['status']] += 1
+            results['bytes_before'] += result['before']
+            results['bytes_after'] += result['after']
+            if verbose >= 2 or (verbose >= 1 and result['status'] == 'failed'):
+                print(f'{result["status"]}: {path}')
+            # Failures are recorded too so that files strip can't handle
+            # (such as linker scripts) aren't retried.
+            record[path] = record_entry(
+                path, sha256=file_sha256(path), status=result['status'])
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Strip libraries, skipping those that were already '
+        'stripped.')
+    parser.add_argument(
+        'roots', nargs='*', default=['/usr/local'],
+        help='Directories to search for libraries.')
+    parser.add_argument(
+        '--pattern', action='append',
+        help='File name patterns to strip.  Default is *.so and *.a.')
+    parser.add_argument(
+        '--record',
+        help=f'A json file of processed libraries.  Default is {defaultRecord} '
+        'if that directory exists.')
+    parser.add_argument(
+        '--no-record', action='store_true', help='Process every library.')
+    parser.add_argument(
+        '--strip', default=os.environ.get('STRIP', 'strip'),
+        help='The strip executable.')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count(),
+        help='The number of libraries to strip at once.')
+    parser.add_argument(
+        '--verbose', '-v', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+
+    recordPath = args.record
+    if not recordPath and os.path.isdir(os.path.dirname(defaultRecord)):
+        recordPath = defaultRecord
+    if args.no_record:
+        recordPath = None
+    record = {}
+    if recordPath and os.path.exists(recordPath):
+        record = json.load(open(recordPath))
+    start = time.time()
+    paths = find_libraries(args.roots, args.pattern or ['*.so', '*.a'])
+    results = strip_libraries(paths, record, args.jobs, args.strip, args.verbose)
+    if recordPath:
+        json.dump(record, open(recordPath + '.tmp', 'w'), indent=1, sort_keys=True)
+        os.replace(recordPath + '.tmp', recordPath)
+    print('Strip: %d files, %d skipped, %d stripped, %d unchanged, %d failed; '
+          '%d bytes processed, %d saved in %5.3fs' % (
+              results['files'], results['skipped'], results['stripped'],
+              results['unchanged'], results['failed'], results['bytes_before'],
+              results['bytes_before'] - results['bytes_after'], time.time() - start))
@@ -0,0 +1,10 @@
+#!/usr/bin/env bash
+# Run the tile decoding benchmark with the environment that test_script.sh
+# made.  Call as bench_script.sh <container name> <json output path>.
+
+set -e
+
+. /etc/profile || true
+. venv/bin/activate
+
+python /test/bench_tiles.py -v --name "$1" --output "$2"
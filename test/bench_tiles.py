@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Measure how quickly large_image decodes tiles with each tile source.  This
+# runs inside the test containers after test_script.sh has installed the
+# wheels (see test_via_docker.py --bench).  Synthetic tiled, pyramidal images
+# are made with pyvips, so nothing is downloaded.  Each source that can read
+# a fixture is timed fetching full resolution tiles with getTile and regions
+# with getRegion, both decoded to numpy arrays and without tile caching.
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import sysconfig
+import tempfile
+import time
+
+sources = ['tiff', 'openslide', 'gdal', 'vips', 'openjpeg', 'bioformats']
+imageSize = 4096
+tileSize = 256
+regionSize = 1024
+fixtures = {
+    'deflate.tif': ('tiffsave', {'compression': 'deflate'}),
+    'jpeg.tif': ('tiffsave', {'compression': 'jpeg', 'Q': 90}),
+    'webp.tif': ('tiffsave', {'compression': 'webp', 'Q': 90}),
+    'zstd.tif': ('tiffsave', {'compression': 'zstd'}),
+    'image.jp2': ('jp2ksave', {'Q': 90}),
+}
+packages = [
+    'large-image', 'pylibtiff', 'openslide-python', 'GDAL', 'pyvips', 'glymur',
+    'python-javabridge', 'large-image-source-bioformats']
+
+
+def make_fixtures(path):
+    """
+    Make the test images.
+
+    :param path: the directory for the images.
+    :returns: a dictionary of fixture names that couldn't be made and the
+        reason.
+    """
+    try:
+        import pyvips
+    except Exception as exc:
+        return {name: f'pyvips is unavailable: {exc}' for name in fixtures}
+    # Sines and noise in each band compress like a real image rather than a
+    # flat one.
+    bands = []
+    for hfreq, vfreq in [(3, 5), (7, 2), (11, 13)]:
+        sines = pyvips.Image.sines(imageSize, imageSize, hfreq=hfreq, vfreq=vfreq)
+        noise = pyvips.Image.gaussnoise(imageSize, imageSize, mean=128, sigma=24)
+        bands.append((sines * 80 + noise).cast('uchar'))
+    image = bands[0].bandjoin(bands[1:]).copy_memory()
+    failed = {}
+    for name, (method, options) in fixtures.items():
+        try:
+            getattr(image, method)(
+                os.path.join(path, name), tile_width=tileSize, tile_height=tileSize,
+                **(dict(tile=True, pyramid=True) if method == 'tiffsave' else {}),
+                **options)
+        except Exception as exc:
+            failed[name] = str(exc).strip()[-200:] or type(exc).__name__
+    return failed
+
+
+def stats(durations):
+    """
+    Summarize a list of times.
+
+    :param durations: a list of times in seconds.
+    :returns: a dictionary with the count, rate per second, and median and
+        99th percentile latencies in milliseconds.
+    """
+    durations = sorted(durations)
+
+    def percentile(fraction):
+        return durations[min(len(durations) - 1, int(round(fraction * (len(durations) - 1))))]
+
+    return {
+        'count': len(durations),
+        'per_second': len(durations) / sum(durations),
+        'p50_ms': percentile(0.5) * 1000,
+        'p99_ms': percentile(0.99) * 1000,
+    }
+
+
+def open_source(module, path):
+    try:
+        return module.open(path, noCache=True)
+    except TypeError:
+        # Older versions of large_image don't have the noCache option
+        return module.open(path)
+
+
+def bench_source(source, path, maxTiles, maxRegions):
+    """
+    Time a tile source reading a fixture.
+
+    :param source: the name of the source, e.g., 'tiff'.
+    :param path: the path of the fixture.
+    :param maxTiles: the maximum number of tiles to get.
+    :param maxRegions: the maximum number of regions to get.
+    :returns: a dictionary with getTile and getRegion stats or the reason the
+        source was skipped.
+    """
+    import large_image
+
+    try:
+        module = importlib.import_module(f'large_image_source_{source}')
+        ts = open_source(module, path)
+    except Exception as exc:
+        return {'skipped': str(exc).strip()[-200:] or type(exc).__name__}
+    result = {}
+    level = ts.levels - 1
+    tilesX = (ts.sizeX + ts.tileWidth - 1) // ts.tileWidth
+    tilesY = (ts.sizeY + ts.tileHeight - 1) // ts.tileHeight
+    durations = []
+    for idx in range(min(maxTiles, tilesX * tilesY)):
+        start = time.perf_counter()
+        ts.getTile(idx % tilesX, idx // tilesX, level, numpyAllowed='always')
+        durations.append(time.perf_counter() - start)
+    result['getTile'] = stats(durations)
+    durations = []
+    # Regions step diagonally so that they don't start on tile boundaries
+    step = max(1, (min(ts.sizeX, ts.sizeY) - regionSize) // max(1, maxRegions))
+    for idx in range(maxRegions):
+        start = time.perf_counter()
+        ts.getRegion(
+            region=dict(left=idx * step + idx % 7, top=idx * step + idx % 5,
+                        width=regionSize, height=regionSize),
+            format=large_image.constants.TILE_FORMAT_NUMPY)
+        durations.append(time.perf_counter() - start)
+    result['getRegion'] = stats(durations)
+    return result
+
+
+def package_versions():
+    try:
+        import importlib.metadata as metadata
+    except ImportError:
+        return {}
+    versions = {}
+    for name in packages:
+        try:
+            versions[name] = metadata.version(name)
+        except Exception:
+            pass
+    return versions
+
+
+def bench(path, maxTiles=256, maxRegions=16, verbose=0):
+    """
+    Make the fixtures and time every source on each of them.
+
+    :param path: the directory for the fixtures.
+    :param maxTiles: the maximum number of tiles to get from each fixture.
+    :param maxRegions: the maximum number of regions to get from each fixture.
+    :param verbose: verbosity level.
+    :returns: a dictionary of results keyed by <source>/<fixture>.
+    """
+    failed = make_fixtures(path)
+    results = {}
+    for source in sources:
+        for fixture in fixtures:
+            key = f'{source}/{fixture}'
+            if fixture in failed:
+                results[key] = {'skipped': f'no fixture: {failed[fixture]}'}
+            else:
+                results[key] = bench_source(
+                    source, os.path.join(path, fixture), maxTiles, maxRegions)
+            if verbose >= 1:
+                result = results[key]
+                if 'skipped' in result:
+                    print('%-24s skipped: %s' % (key, result['skipped'].splitlines()[-1]))
+                else:
+                    print('%-24s %8.1f tiles/s p50 %7.2fms p99 %7.2fms  '
+                          '%6.1f regions/s p50 %7.2fms p99 %7.2fms' % (
+                              key, result['getTile']['per_second'],
+                              result['getTile']['p50_ms'], result['getTile']['p99_ms'],
+                              result['getRegion']['per_second'],
+                              result['getRegion']['p50_ms'], result['getRegion']['p99_ms']))
+                sys.stdout.flush()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure large_image tile decoding speed for each source.')
+    parser.add_argument('--output', '-o', help='Write json results to this path.')
+    parser.add_argument('--name', help='The name of the container to record.')
+    parser.add_argument(
+        '--tiles', type=int, default=256,
+        help='The maximum number of tiles to get from each image.')
+    parser.add_argument(
+        '--regions', type=int, default=16,
+        help='The number of regions to get from each image.')
+    parser.add_argument(
+        '--verbose', '-v', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_') as tempdir:
+        results = bench(tempdir, args.tiles, args.regions, args.verbose)
+    record = {
+        'container': args.name,
+        'python': platform.python_version() + (
+            't' if sysconfig.get_config_var('Py_GIL_DISABLED') else ''),
+        'machine': platform.machine(),
+        'versions': package_versions(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fptr:
+            json.dump(record, fptr, indent=1)
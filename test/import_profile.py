@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# Profile importing the packages from the wheels.  This runs inside the test
+# containers after test_script.sh has installed the wheels (see
+# test_via_docker.py --imports).  Each package, and then all of them
+# together, is imported in a fresh python process with -X importtime.  This
+# records the wall time of the import and of a first call, the slowest
+# modules in the import tree, and the shared objects the import added to
+# /proc/self/maps.  If the shared objects exceed their size budget, this exits
+# with an error.  Import times exceeding their budget are reported as
+# warnings, since they depend on the load on the machine, unless --strict is
+# given.
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import sysconfig
+
+# The statement to import each package and, optionally, a first call whose
+# latency is recorded separately.
+packages = {
+    'libtiff': ('import libtiff', None),
+    'openslide': ('import openslide', None),
+    'pyvips': ('import pyvips', 'pyvips.Image.black(16, 16).avg()'),
+    'osgeo': ('from osgeo import gdal', 'gdal.GetDriverByName("MEM").Create("", 16, 16)'),
+    'mapnik': ('import mapnik', 'mapnik.Map(16, 16)'),
+    'glymur': ('import glymur', None),
+    'javabridge': ('import javabridge', None),
+    'pylibmc': ('import pylibmc', 'pylibmc.Client(["127.0.0.1"])'),
+}
+# Budgets for the median import time in seconds and the size in megabytes of
+# the shared objects the import maps.
+budgets = {
+    'libtiff': {'seconds': 0.5, 'mapped_mb': 100},
+    'openslide': {'seconds': 1, 'mapped_mb': 150},
+    'pyvips': {'seconds': 1, 'mapped_mb': 200},
+    'osgeo': {'seconds': 1, 'mapped_mb': 300},
+    'mapnik': {'seconds': 2, 'mapped_mb': 300},
+    'glymur': {'seconds': 1, 'mapped_mb': 100},
+    'javabridge': {'seconds': 1, 'mapped_mb': 100},
+    'pylibmc': {'seconds': 0.5, 'mapped_mb': 50},
+    'all': {'seconds': 4, 'mapped_mb': 600},
+}
+
+# This runs in the child process.  It prints a json record on the last line
+# of stdout.
+childScript = '''
+import json, os, sys, time
+
+def maps():
+    objects = set()
+    with open('/proc/self/maps') as fptr:
+        for line in fptr:
+            parts = line.split(None, 5)
+            if len(parts) == 6 and '.so' in os.path.basename(parts[5].strip()):
+                objects.add(parts[5].strip())
+    return objects
+
+before = maps()
+start = time.perf_counter()
+exec(%(imports)r)
+importTime = time.perf_counter() - start
+start = time.perf_counter()
+exec(%(calls)r)
+callTime = time.perf_counter() - start
+added = sorted(maps() - before)
+sizes = {path: os.path.getsize(path) for path in added if os.path.exists(path)}
+print(json.dumps({
+    'import_seconds': importTime, 'first_call_seconds': callTime,
+    'shared_objects': len(added), 'mapped_bytes': sum(sizes.values()),
+    'largest': sorted(sizes.items(), key=lambda item: -item[1])[:5]}))
+'''
+
+
+def parse_importtime(text, minMicroseconds):
+    """
+    Parse the -X importtime output.
+
+    :param text: the stderr of the python process.
+    :param minMicroseconds: omit modules whose cumulative time is less than
+        this.
+    :returns: a list of [module, depth, self microseconds, cumulative
+        microseconds] in import order.
+    """
+    tree = []
+    for line in text.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        try:
+            selfTime, cumulative, name = line.split(':', 1)[1].split('|')
+            selfTime, cumulative = int(selfTime), int(cumulative)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if cumulative >= minMicroseconds:
+            tree.append([name.strip(), depth, selfTime, cumulative])
+    return tree
+
+
+def profile(names, repeat=3, minMicroseconds=1000):
+    """
+    Import packages in fresh processes.
+
+    :param names: a list of package names from the packages dictionary.
+    :param repeat: the number of processes to time.
+    :param minMicroseconds: the smallest cumulative import time to keep in
+        the import tree.
+    :returns: a dictionary with the median and each run's import time, the
+        first call latency, the shared objects added, and the import tree of
+        the first run, or the reason the import failed.
+    """
+    imports = '\n'.join(packages[name][0] for name in names)
+    calls = '\n'.join(packages[name][1] for name in names if packages[name][1])
+    script = childScript % {'imports': imports, 'calls': calls}
+    runs = []
+    tree = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf8', errors='replace')
+        if proc.returncode:
+            lines = [line for line in proc.stderr.splitlines()
+                     if not line.startswith('import time:')]
+            return {'skipped': '\n'.join(lines[-3:]) or f'exit code {proc.returncode}'}
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        if tree is None:
+            tree = parse_importtime(proc.stderr, minMicroseconds)
+    times = sorted(run['import_seconds'] for run in runs)
+    calls = sorted(run['first_call_seconds'] for run in runs)
+    return {
+        'import_seconds': times[len(times) // 2],
+        'runs': [run['import_seconds'] for run in runs],
+        'first_call_seconds': calls[len(calls) // 2],
+        'shared_objects': runs[0]['shared_objects'],
+        'mapped_bytes': runs[0]['mapped_bytes'],
+        'largest': runs[0]['largest'],
+        'importtime': tree,
+    }
+
+
+def over_budget(results, strict=False):
+    """
+    Check results against the budgets.
+
+    :param results: a dictionary of results from profile keyed by package name
+        or 'all'.
+    :param strict: if True, exceeded time budgets are errors rather than
+        warnings.
+    :returns: a list of descriptions of exceeded budgets that are errors and a
+        list of those that are warnings.
+    """
+    exceeded = []
+    warnings = []
+    for name, result in results.items():
+        budget = budgets.get(name)
+        if not budget or 'skipped' in result:
+            continue
+        if result['import_seconds'] > budget['seconds']:
+            (exceeded if strict else warnings).append(
+                '%s import took %5.3fs; the budget is %gs' % (
+                    name, result['import_seconds'], budget['seconds']))
+        if result['mapped_bytes'] > budget['mapped_mb'] * 1024 ** 2:
+            exceeded.append('%s mapped %d shared objects of %5.1f MB; the budget is %g MB' % (
+                name, result['shared_objects'], result['mapped_bytes'] / 1024 ** 2,
+                budget['mapped_mb']))
+    return exceeded, warnings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Profile importing the packages from the wheels.')
+    parser.add_argument('--output', '-o', help='Write json results to this path.')
+    parser.add_argument('--name', help='The name of the container to record.')
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='Times to import each package.')
+    parser.add_argument(
+        '--min-us', type=int, default=1000,
+        help='Omit modules that take less than this many microseconds from '
+        'the recorded import trees.')
+    parser.add_argument(
+        '--no-budgets', action='store_true', help='Report without failing.')
+    parser.add_argument(
+        '--strict', action='store_true',
+        help='Fail if an import time budget is exceeded.  Otherwise, only the '
+        'shared object size budgets fail.')
+    parser.add_argument(
+        '--verbose', '-v', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+
+    results = {}
+    for name in list(packages) + ['all']:
+        names = [name] if name != 'all' else [
+            key for key in packages if 'skipped' not in results[key]]
+        results[name] = profile(names, args.repeat, args.min_us) if names else {
+            'skipped': 'no packages could be imported'}
+        if args.verbose >= 1:
+            result = results[name]
+            if 'skipped' in result:
+                print('%-12s skipped: %s' % (name, result['skipped'].splitlines()[-1]))
+            else:
+                print('%-12s import %6.3fs  first call %6.3fs  %3d shared objects %6.1f MB' % (
+                    name, result['import_seconds'], result['first_call_seconds'],
+                    result['shared_objects'], result['mapped_bytes'] / 1024 ** 2))
+            sys.stdout.flush()
+    exceeded, warnings = over_budget(results, args.strict)
+    if warnings:
+        print('Import time budgets exceeded:\n' + '\n'.join(warnings))
+    if args.output:
+        with open(args.output, 'w') as fptr:
+            json.dump({
+                'container': args.name,
+                'python': platform.python_version() + (
+                    't' if sysconfig.get_config_var('Py_GIL_DISABLED') else ''),
+                'machine': platform.machine(),
+                'budgets': budgets,
+                'exceeded': exceeded,
+                'warnings': warnings,
+                'results': results,
+            }, fptr, indent=1)
+    if exceeded and not args.no_budgets:
+        sys.exit('Import budgets exceeded:\n' + '\n'.join(exceeded))
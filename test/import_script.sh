@@ -0,0 +1,10 @@
+#!/usr/bin/env bash
+# Profile importing the packages with the environment that test_script.sh
+# made.  Call as import_script.sh <container name> <json output path> [--strict].
+
+set -e
+
+. /etc/profile || true
+. venv/bin/activate
+
+python /test/import_profile.py -v --name "$1" --output "$2" ${3:+"$3"}
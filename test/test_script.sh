@@ -99,6 +99,8 @@ fi
 if $TEST_BIOFORMATS && $TEST_GDAL && $TEST_GLYMUR && $TEST_JAVABRIDGE && $TEST_MAPNIK && $TEST_OPENSLIDE && $TEST_PYLIBMC && $TEST_PYLIBTIFF && $TEST_PYVIPS; then
   echo 'Test basic imports of all wheels'
   python -c 'import libtiff, openslide, pyvips, osgeo, mapnik, glymur, javabridge'
+  echo 'Test imports with the baseline libraries rather than instruction set variants'
+  LARGE_IMAGE_WHEELS_ISA=baseline python -c 'import libtiff, openslide, pyvips, osgeo, mapnik, glymur, javabridge;from osgeo import gdal;print(osgeo.GDAL_LIBRARY_PATH)'
 fi
 if $TEST_GDAL; then
   echo 'Time import of gdal'
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
 import multiprocessing.pool
 import os
 import platform
+import re
+import shlex
 import subprocess
 import sys
 import threading
@@ -93,7 +96,56 @@ if platform.machine() not in {'aarch64', 'arm64'}:
 # print('Passed')
 
 
-def test_container(container, entry, full, options=None):
+def bench_name(container, suffix='.json'):
+    """
+    Get the file name used for a container's benchmark results.
+
+    :param container: the container key, e.g., 'python:3.9-slim'.
+    :param suffix: the end of the file name.  Import profiles use
+        '.imports.json'.
+    :returns: a json file name.
+    """
+    return re.sub(r'[^A-Za-z0-9.-]+', '_', container) + suffix
+
+
+def compare_bench(previous, current, threshold):
+    """
+    Compare benchmark results with an earlier run.
+
+    :param previous: the earlier results from bench_tiles.py.
+    :param current: the new results.
+    :param threshold: the fraction by which throughput can drop or p99 latency
+        can rise before it is a regression.
+    :returns: a list of regression descriptions.
+    """
+    regressions = []
+    for key, old in previous['results'].items():
+        new = current['results'].get(key, {'skipped': 'not run'})
+        if 'skipped' in old:
+            continue
+        if 'skipped' in new:
+            regressions.append(f'{key} no longer works: {new["skipped"]}')
+            continue
+        for method in ('getTile', 'getRegion'):
+            if method not in old or method not in new:
+                continue
+            ratio = new[method]['per_second'] / old[method]['per_second']
+            if ratio < 1 - threshold:
+                regressions.append(
+                    '%s %s %.1f/s -> %.1f/s (%+.1f%%)' % (
+                        key, method, old[method]['per_second'],
+                        new[method]['per_second'], (ratio - 1) * 100))
+            ratio = new[method]['p99_ms'] / old[method]['p99_ms']
+            if ratio > 1 + threshold:
+                regressions.append(
+                    '%s %s p99 %.2fms -> %.2fms (%+.1f%%)' % (
+                        key, method, old[method]['p99_ms'],
+                        new[method]['p99_ms'], (ratio - 1) * 100))
+    return regressions
+
+
+def test_container(container, entry, full, options=None, outputDir=None,
+                   bench=False, imports=False, strict=False):
     if options is None:
         options = {}
     subcmds = options.get('subcmds')
@@ -115,10 +167,19 @@ def test_container(container, entry, full, options=None):
     subcmds.append('bash /test/test_script.sh')
     if full:
         subcmds.append('bash /test/li_script.sh')
+    if imports:
+        subcmds.append('bash /test/import_script.sh %s /bench/%s%s' % (
+            shlex.quote(entry['container']),
+            bench_name(entry['container'], '.imports.json'),
+            ' --strict' if strict else ''))
+    if bench:
+        subcmds.append('bash /test/bench_script.sh %s /bench/%s' % (
+            shlex.quote(entry['container']), bench_name(entry['container'])))
     maincmd = [
         'docker', 'run',
         '-v', '%s/wheels:/wheels' % os.path.dirname(os.path.realpath(__file__)),
         '-v', '%s/test:/test' % os.path.dirname(os.path.realpath(__file__)),
+    ] + (['-v', '%s:/bench' % os.path.realpath(outputDir)] if outputDir else []) + [
         '--rm', container, 'bash', '-e', '-c',
         ' && '.join(subcmds),
     ]
@@ -158,48 +219,108 @@ if __name__ == '__main__':  # noqa
     parser.add_argument(
         '--dry-run', '-n', action='store_true',
         help='Just report which tests will be run.')
+    parser.add_argument(
+        '--bench', action='store_true',
+        help='Also measure large_image tile decoding speed in each container.  '
+        'This is done one container at a time after the tests pass.')
+    parser.add_argument(
+        '--imports', action='store_true',
+        help='Also profile importing each package in each container.  This is '
+        'done one container at a time after the tests pass.  This fails if an '
+        'import exceeds its shared object size budget.  Exceeded time budgets '
+        'are warnings unless --strict-imports is given.')
+    parser.add_argument(
+        '--strict-imports', action='store_true',
+        help='Fail if an import exceeds its time budget.')
+    parser.add_argument(
+        '--bench-output', default='bench',
+        help='The directory for the benchmark and import profile json '
+        'results.')
+    parser.add_argument(
+        '--bench-baseline',
+        help='A directory of benchmark results from the previous release.  '
+        'Regressions beyond the threshold fail the run.')
+    parser.add_argument(
+        '--bench-threshold', type=float, default=0.15,
+        help='The fraction by which throughput can drop or p99 latency can '
+        'rise before it is reported as a regression.')
     parser.add_argument(
         '--only', action='store_true',
         help='Only run tests that exactly match the spec.')
     opts = parser.parse_args()
+    bench = opts.bench_output if opts.bench or opts.imports else None
+    if bench and not opts.dry_run:
+        os.makedirs(bench, exist_ok=True)
     count = multiprocessing.cpu_count()
     if opts.jobs:
         count = max(1, min(opts.jobs if opts.jobs > 1 else count + opts.jobs, count))
-    pool = multiprocessing.pool.ThreadPool(processes=count)
-    results = []
-    for container in containers:
-        if opts.spec and opts.spec not in container:
-            continue
-        if opts.only and opts.spec and opts.spec != container:
-            continue
-        if containers[container].get('skip') and (not opts.spec or not opts.only):
-            continue
-        entry = {'out': [], 'lock': threading.Lock(), 'status': 'queued', 'container': container}
-        if opts.dry_run:
-            result = 'test'
-        else:
-            result = pool.apply_async(
-                test_container, (container.split()[0], entry, opts.full, containers[container]))
-        entry['result'] = result
-        results.append(entry)
-    pool.close()
-    for entry in results:
-        container = entry['container']
+    # Benchmarks and import profiles are timed, so they are run one container
+    # at a time after the tests rather than alongside other containers.
+    passes = [{'count': count, 'full': opts.full, 'timed': False, 'label': 'Starting'}]
+    if opts.bench or opts.imports:
+        passes.append({'count': 1, 'full': False, 'timed': True, 'label': 'Timing'})
+    for testPass in passes:
+        pool = multiprocessing.pool.ThreadPool(processes=testPass['count'])
+        results = []
+        for container in containers:
+            if opts.spec and opts.spec not in container:
+                continue
+            if opts.only and opts.spec and opts.spec != container:
+                continue
+            if containers[container].get('skip') and (not opts.spec or not opts.only):
+                continue
+            entry = {'out': [], 'lock': threading.Lock(), 'status': 'queued',
+                     'container': container}
+            if opts.dry_run:
+                result = 'test'
+            else:
+                result = pool.apply_async(
+                    test_container, (container.split()[0], entry, testPass['full'],
+                                     containers[container], bench,
+                                     opts.bench and testPass['timed'],
+                                     opts.imports and testPass['timed'],
+                                     opts.strict_imports))
+            entry['result'] = result
+            results.append(entry)
+        pool.close()
+        for entry in results:
+            container = entry['container']
+            if opts.dry_run:
+                print(container)
+                continue
+            print('---- %s in %s ----' % (testPass['label'], container))
+            while True:
+                with entry['lock']:
+                    while len(entry['out']):
+                        sys.stdout.write(entry['out'].pop(0))
+                    if entry['result'].ready():
+                        break
+                entry['result'].wait(0.1)
+            if entry['status'] == 'failed':
+                print('---- Failed in %s ----' % container)
+                raise entry['exception']
+            print('---- Passed in %s ----' % container)
         if opts.dry_run:
-            print(container)
-            continue
-        print('---- Starting in %s ----' % container)
-        while True:
-            with entry['lock']:
-                while len(entry['out']):
-                    sys.stdout.write(entry['out'].pop(0))
-                if entry['result'].ready():
-                    break
-            entry['result'].wait(0.1)
-        if entry['status'] == 'failed':
-            print('---- Failed in %s ----' % container)
-            raise entry['exception']
-        print('---- Passed in %s ----' % container)
+            break
+    if opts.bench and opts.bench_baseline and not opts.dry_run:
+        regressions = []
+        for entry in results:
+            name = bench_name(entry['container'])
+            previousPath = os.path.join(opts.bench_baseline, name)
+            if not os.path.exists(previousPath):
+                print('---- No baseline benchmark for %s ----' % entry['container'])
+                continue
+            with open(previousPath) as fptr:
+                previous = json.load(fptr)
+            with open(os.path.join(bench, name)) as fptr:
+                current = json.load(fptr)
+            regressions += ['%s: %s' % (entry['container'], regression)
+                            for regression in compare_bench(
+                                previous, current, opts.bench_threshold)]
+        if regressions:
+            print('---- Benchmark regressions ----')
+            print('\n'.join(regressions))
+            sys.exit(1)
     if not opts.dry_run:
         print('Passed')
 
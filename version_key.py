@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Sort keys for upstream version strings.
+#
+# versionKey(version) orders versions the same way that sorting with
+# functools.cmp_to_key(compareVersions) does, but each string is parsed only
+# once and the result is memoized across packages.  Run this script to
+# benchmark both approaches on real tag lists and confirm they agree:
+#   version_key.py [<package> ...] [--offline]
+
+import argparse
+import functools
+import os
+import re
+import time
+
+import packaging.version
+
+
+def compareVersions(a, b):  # noqa
+    """
+    Compare two version strings.  Versions are parsed by packaging; if that
+    fails, '_' and '-' are treated as '.'.  Strings that still can't be
+    parsed sort before all versions and are compared as strings.
+    Prereleases sort before all other versions.
+
+    This is the original comparison function; it is retained as the
+    reference for versionKey.
+    """
+    try:
+        av = packaging.version.parse(a)
+    except Exception:
+        try:
+            av = packaging.version.parse(a.replace('_', '.').replace('-', '.'))
+        except Exception:
+            av = a
+    try:
+        bv = packaging.version.parse(b)
+    except Exception:
+        try:
+            bv = packaging.version.parse(b.replace('_', '.').replace('-', '.'))
+        except Exception:
+            bv = b
+    if isinstance(av, str) and not isinstance(bv, str):
+        return -1
+    if not isinstance(av, str) and isinstance(bv, str):
+        return 1
+    try:
+        if av.is_prerelease != bv.is_prerelease:
+            return -1 if av.is_prerelease else 1
+    except Exception:
+        pass
+    if av < bv:
+        return -1
+    if av > bv:
+        return 1
+    return 0
+
+
+@functools.lru_cache(maxsize=None)
+def versionKey(version):
+    """
+    Get a sort key for a version string that orders the same as
+    compareVersions.
+
+    :param version: a version string.
+    :returns: a tuple.  Unparsable strings are (0, version); parsed versions
+        are (1, <True if not a prerelease>, <packaging Version>).
+    """
+    for value in (version, version.replace('_', '.').replace('-', '.')):
+        try:
+            parsed = packaging.version.parse(value)
+        except Exception:
+            continue
+        return (1, not parsed.is_prerelease, parsed)
+    return (0, version)
+
+
+def benchmark(name, versions, repeat=5):
+    """
+    Time sorting a list of versions with compareVersions and with versionKey
+    and check that both produce the same order.
+
+    :param name: a name to report.
+    :param versions: a list of version strings.
+    :param repeat: the number of times to sort with each method.  The best
+        time is reported.
+    :returns: a dictionary of results.
+    """
+    cmpTimes = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cmpSorted = sorted(versions, key=functools.cmp_to_key(compareVersions))
+        cmpTimes.append(time.perf_counter() - start)
+    coldTimes = []
+    warmTimes = []
+    for _ in range(repeat):
+        versionKey.cache_clear()
+        start = time.perf_counter()
+        keySorted = sorted(versions, key=versionKey)
+        coldTimes.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        sorted(versions, key=versionKey)
+        warmTimes.append(time.perf_counter() - start)
+    return {
+        'name': name,
+        'count': len(versions),
+        'equal': cmpSorted == keySorted,
+        'cmp': min(cmpTimes),
+        'cold': min(coldTimes),
+        'warm': min(warmTimes),
+    }
+
+
+if __name__ == '__main__':
+    import check_versions
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark sorting the tags of packages with '
+        'compareVersions and versionKey.')
+    parser.add_argument(
+        'packages', nargs='*', default=['boost', 'icu4c', 'imagemagick'],
+        help='Packages from check_versions.py that use git tags.')
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='Number of times to sort with each method.')
+    parser.add_argument(
+        '--offline', action='store_true',
+        help='Only use tags cached by check_versions.py.')
+    args = parser.parse_args()
+    check_versions.cacheDir = check_versions.defaultCacheDir
+    os.makedirs(check_versions.cacheDir, exist_ok=True)
+    check_versions.offline = args.offline
+
+    failed = False
+    print('%-14s %6s %10s %10s %10s %8s %s' % (
+        'package', 'tags', 'cmp (s)', 'cold (s)', 'warm (s)', 'speedup', 'equal'))
+    for pkg in args.packages:
+        pkginfo = check_versions.Packages[pkg]
+        entries = check_versions.gitRemoteRefs(pkginfo['git'])['tags']
+        # Benchmark both the versions extracted by the package's regex and
+        # the raw tag names, since the latter have more unparsable strings.
+        tests = [
+            (pkg, [re.search(pkginfo['re'], entry).group(1) for entry in entries
+                   if re.search(pkginfo['re'], entry)]),
+            (pkg + ' (tags)', [entry.split('refs/tags/', 1)[-1] for entry in entries]),
+        ]
+        for name, versions in tests:
+            result = benchmark(name, versions, args.repeat)
+            print('%-14s %6d %10.6f %10.6f %10.6f %7.1fx %s' % (
+                result['name'], result['count'], result['cmp'], result['cold'],
+                result['warm'], result['cmp'] / max(result['cold'], 1e-9),
+                result['equal']))
+            failed = failed or not result['equal']
+    if failed:
+        raise Exception('versionKey and compareVersions disagree')
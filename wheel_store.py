@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# A content-addressed store for wheels.  The wheels for each python version
+# of a library carry the same vendored .libs and bin payloads, so storing
+# each wheel's compressed member data as a blob named by its sha256 keeps a
+# single copy of each payload.  A small json recipe per wheel records the
+# zip headers and the blobs in order, so the original wheel can be rebuilt
+# byte-for-byte.
+#
+# wheel_store.py pack [<wheel or directory> ...] [--store <path>]
+#   Add wheels to the store.
+# wheel_store.py unpack [<wheel name> ...] [--store <path>] [--dest <path>]
+#   Rebuild wheels from the store and verify their sha256.
+# wheel_store.py stats [--store <path>]
+#   Report the deduplication ratio.
+
+import argparse
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import struct
+import sys
+import zipfile
+
+import make_index
+
+recipeDir = 'wheels'
+blobDir = 'blobs'
+
+
+def blob_path(store, sha):
+    return os.path.join(store, blobDir, sha[:2], sha)
+
+
+def recipe_path(store, name):
+    return os.path.join(store, recipeDir, name + '.json')
+
+
+def write_blob(store, data):
+    """
+    Add data to the store if it isn't already there.
+
+    :param store: the path of the store.
+    :param data: the bytes to store.
+    :returns: the sha256 of the data and the number of bytes written (0 if
+        the blob was already present).
+    """
+    sha = hashlib.sha256(data).hexdigest()
+    path = blob_path(store, sha)
+    if os.path.exists(path):
+        return sha, 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tempPath = f'{path}.{os.getpid()}.tmp'
+    open(tempPath, 'wb').write(data)
+    os.replace(tempPath, path)
+    return sha, len(data)
+
+
+def segments(path):
+    """
+    Split a wheel into literal header bytes and member data.
+
+    :param path: the path of the wheel.
+    :returns: a list of (literal bytes, member data bytes) tuples in file
+        order, and the bytes after the last member (the central directory and
+        end record).
+    """
+    with zipfile.ZipFile(path) as zptr:
+        infolist = sorted(zptr.infolist(), key=lambda entry: entry.header_offset)
+    parts = []
+    with open(path, 'rb') as fptr:
+        pos = 0
+        for entry in infolist:
+            fptr.seek(entry.header_offset)
+            header = fptr.read(30)
+            namelen, extralen = struct.unpack('<HH', header[26:30])
+            start = entry.header_offset + 30 + namelen + extralen
+            fptr.seek(pos)
+            literal = fptr.read(start - pos)
+            parts.append((literal, fptr.read(entry.compress_size)))
+            pos = start + entry.compress_size
+        fptr.seek(pos)
+        tail = fptr.read()
+    return parts, tail
+
+
+def pack_wheel(store, path, sha256):
+    """
+    Add a wheel to the store.
+
+    :param store: the path of the store.
+    :param path: the path of the wheel.
+    :param sha256: the sha256 of the wheel.
+    :returns: the number of bytes in the wheel and the number of new blob
+        bytes written.
+    """
+    parts, tail = segments(path)
+    recipe = {
+        'name': os.path.basename(path),
+        'size': os.path.getsize(path),
+        'sha256': sha256,
+        'parts': [],
+    }
+    written = 0
+    for literal, data in parts:
+        sha, added = write_blob(store, data)
+        written += added
+        recipe['parts'].append([base64.b64encode(literal).decode(), sha, len(data)])
+    recipe['tail'], added = write_blob(store, tail)
+    written += added
+    os.makedirs(os.path.join(store, recipeDir), exist_ok=True)
+    rpath = recipe_path(store, recipe['name'])
+    json.dump(recipe, open(rpath + '.tmp', 'w'))
+    os.replace(rpath + '.tmp', rpath)
+    return recipe['size'], written
+
+
+def unpack_wheel(store, name, dest):
+    """
+    Rebuild a wheel from the store and verify it.
+
+    :param store: the path of the store.
+    :param name: the wheel file name.
+    :param dest: the directory to write the wheel to.
+    :returns: the path of the wheel.
+    """
+    recipe = json.load(open(recipe_path(store, name)))
+    path = os.path.join(dest, name)
+    sha256 = hashlib.sha256()
+    with open(path + '.tmp', 'wb') as fptr:
+        for literal, sha, size in recipe['parts']:
+            for data in (base64.b64decode(literal), open(blob_path(store, sha), 'rb').read()):
+                fptr.write(data)
+                sha256.update(data)
+        data = open(blob_path(store, recipe['tail']), 'rb').read()
+        fptr.write(data)
+        sha256.update(data)
+    if sha256.hexdigest() != recipe['sha256']:
+        os.unlink(path + '.tmp')
+        raise Exception(f'Rebuilt {name} does not match its sha256')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def pack(store, paths, jobs=None, verbose=0):
+    """
+    Add wheels to the store.  Wheels whose recipe already records the same
+    sha256 are skipped.  Wheel digests use the make_index.py digest cache of
+    each directory.
+
+    :param store: the path of the store.
+    :param paths: a list of wheel files and directories of wheels.
+    :param jobs: the number of processes to use.
+    :param verbose: verbosity level.
+    :returns: the total size of the packed wheels and the number of new blob
+        bytes.
+    """
+    byDir = {}
+    for path in paths:
+        if os.path.isdir(path):
+            byDir.setdefault(path, []).extend(
+                name for name in sorted(os.listdir(path)) if name.endswith('.whl'))
+        else:
+            byDir.setdefault(os.path.dirname(path) or '.', []).append(os.path.basename(path))
+    tasks = []
+    for wpath, names in byDir.items():
+        cachePath = os.path.join(wpath, make_index.cacheName)
+        cache = make_index.load_cache(cachePath)
+        shas = make_index.get_sha256s(wpath, names, cache, False, verbose)
+        make_index.save_cache(cachePath, cache)
+        for name, sha in zip(names, shas):
+            rpath = recipe_path(store, name)
+            if os.path.exists(rpath) and json.load(open(rpath))['sha256'] == sha:
+                continue
+            tasks.append((store, os.path.join(wpath, name), sha))
+    total = written = 0
+    if tasks:
+        with multiprocessing.Pool(jobs) as pool:
+            for task, (size, added) in zip(tasks, pool.starmap(pack_wheel, tasks)):
+                if verbose >= 1:
+                    print(f'Packed {os.path.basename(task[1])}: {added} of {size} bytes new')
+                total += size
+                written += added
+    return total, written
+
+
+def stats(store):
+    """
+    Compute the deduplication ratio of the store.
+
+    :param store: the path of the store.
+    :returns: a dictionary of results.
+    """
+    result = {'wheels': 0, 'wheel_bytes': 0, 'blobs': 0, 'blob_bytes': 0, 'recipe_bytes': 0}
+    for name in os.listdir(os.path.join(store, recipeDir)):
+        path = os.path.join(store, recipeDir, name)
+        result['wheels'] += 1
+        result['wheel_bytes'] += json.load(open(path))['size']
+        result['recipe_bytes'] += os.path.getsize(path)
+    for root, _dirs, files in os.walk(os.path.join(store, blobDir)):
+        result['blobs'] += len(files)
+        result['blob_bytes'] += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    result['ratio'] = result['wheel_bytes'] / max(
+        1, result['blob_bytes'] + result['recipe_bytes'])
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Store wheels as deduplicated content-addressed blobs and '
+        'rebuild them byte-for-byte.')
+    parser.add_argument('command', choices=['pack', 'unpack', 'stats'])
+    parser.add_argument(
+        'paths', nargs='*',
+        help='For pack, wheels or directories of wheels (default wheelhouse).  '
+        'For unpack, wheel names (default all wheels in the store).')
+    parser.add_argument(
+        '--store', default='wheelstore', help='The path of the store.')
+    parser.add_argument(
+        '--dest', default='wheelhouse',
+        help='The directory for rebuilt wheels.')
+    parser.add_argument(
+        '-j', '--jobs', type=int,
+        help='The number of processes to use.  This defaults to the number '
+        'of cpus.')
+    parser.add_argument(
+        '--json', action='store_true', help='Report stats as json.')
+    parser.add_argument(
+        '--verbose', '-v', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        total, written = pack(args.store, args.paths or ['wheelhouse'], args.jobs, args.verbose)
+        print(f'Packed {total} bytes of wheels; {written} bytes of new blobs')
+    elif args.command == 'unpack':
+        names = args.paths or sorted(
+            name[:-5] for name in os.listdir(os.path.join(args.store, recipeDir)))
+        os.makedirs(args.dest, exist_ok=True)
+        with multiprocessing.Pool(args.jobs) as pool:
+            for path in pool.starmap(unpack_wheel, [
+                    (args.store, name, args.dest) for name in names]):
+                if args.verbose >= 1:
+                    print(f'Rebuilt {path}')
+    if args.command == 'stats' or args.verbose >= 1:
+        result = stats(args.store)
+        if args.json:
+            json.dump(result, sys.stdout, indent=1)
+            sys.stdout.write('\n')
+        else:
+            print('%d wheels, %d bytes; %d blobs, %d bytes; %d recipe bytes; '
+                  'deduplication ratio %.2f' % (
+                      result['wheels'], result['wheel_bytes'], result['blobs'],
+                      result['blob_bytes'], result['recipe_bytes'], result['ratio']))